@@ -0,0 +1,48 @@
+"""Measures how many prompts per second the builders and the bulk constructors make.
+
+    PYTHONPATH=. python benchmarks/bench_prompts.py
+"""
+import time
+from collections import deque
+from chatfusion.prompts.prompts import Prompt, ChatPrompt, SingleMessagePrompt
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ROWS = 200_000
+SYSTEM = 'Answer in one sentence.'
+
+
+def bench(name: str, build, repeat: int = 3):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        # consume without keeping the prompts, like a batch run does
+        deque(build(), maxlen=0)
+        best = min(best, time.perf_counter() - started)
+    print(f"{name:<40} {ROWS / best:>12,.0f} prompts/s")
+
+
+def main():
+    questions = [f"What is the capital of country number {i}?" for i in range(ROWS)]
+    records = [{'id': i, 'prompt': question} for i, question in enumerate(questions)]
+    message_records = [{'messages': [{'role': 'system', 'content': SYSTEM}, {'role': 'user', 'content': question}]}
+                       for question in questions]
+
+    bench('builder chain, chat', lambda: (Prompt().chat().system(SYSTEM).user(q) for q in questions))
+    bench('builder chain, single message', lambda: (Prompt().text(q) for q in questions))
+    bench('ChatPrompt.from_column, list', lambda: ChatPrompt.from_column(questions, system=SYSTEM))
+    bench('ChatPrompt.from_column, generator', lambda: ChatPrompt.from_column((q for q in questions), system=SYSTEM))
+    bench('ChatPrompt.from_records, prompt', lambda: ChatPrompt.from_records(records, system=SYSTEM))
+    bench('ChatPrompt.from_records, messages', lambda: ChatPrompt.from_records(message_records))
+    bench('SingleMessagePrompt.from_column, list', lambda: SingleMessagePrompt.from_column(questions))
+    if numpy is not None:
+        column = numpy.array(questions)
+        bench('ChatPrompt.from_column, numpy', lambda: ChatPrompt.from_column(column, system=SYSTEM))
+        bench('SingleMessagePrompt.from_column, numpy', lambda: SingleMessagePrompt.from_column(column))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Measures the per chunk overhead of the streaming transform stages.
+
+    PYTHONPATH=. python benchmarks/bench_transforms.py
+"""
+import time
+from chatfusion.transforms import TransformPipeline, Redact, LineFilter, strip_markdown
+
+EMAIL = r'[\w.+-]+@[\w-]+\.[\w.]+'
+PHONE = r'\d{3}-\d{3}-\d{4}'
+
+SAMPLE = (
+    "## Result\nYou can reach **support** at help@example.com or 555-123-4567. "
+    "Use `pip install chatfusion` to get started.\nDEBUG internal line\n"
+)
+
+
+def make_chunks(total_chars: int, chunk_size: int):
+    text = (SAMPLE * (total_chars // len(SAMPLE) + 1))[:total_chars]
+    return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+
+def bench(name: str, pipeline: TransformPipeline, chunks, repeat: int = 5):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in pipeline.run(chunks):
+            pass
+        best = min(best, time.perf_counter() - started)
+    print(f"{name:<32} {len(chunks):>7} chunks  {best / len(chunks) * 1e6:8.2f} us/chunk")
+
+
+def main():
+    for chunk_size in (4, 16, 64):
+        chunks = make_chunks(200_000, chunk_size)
+        print(f"chunk size {chunk_size}")
+        bench('passthrough', TransformPipeline(), chunks)
+        bench('redact email', TransformPipeline(Redact(EMAIL)), chunks)
+        bench('redact email + phone', TransformPipeline(Redact(EMAIL), Redact(PHONE)), chunks)
+        bench('line filter', TransformPipeline(LineFilter(lambda line: not line.startswith('DEBUG'))), chunks)
+        bench('strip markdown', strip_markdown(), chunks)
+        bench('all stages', TransformPipeline(
+            Redact(EMAIL), Redact(PHONE), LineFilter(lambda line: not line.startswith('DEBUG'))
+        ).then(*strip_markdown().stages), chunks)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from .types import Any, Dict, Iterable, Optional, Tuple, TextIO, Generator, Union
+from .factories import GeneratorFactory
+from .prompts.prompts import ChatPrompt, BasePrompt
+from .generators import ResponseGenerator
+
+
+class BatchCheckpoint:
+    """Tracks which input lines are done using a low watermark plus the few lines finished above it.
+
+    Every line below the watermark is done, so the state stays bounded by the in flight window
+    rather than growing with the size of the input.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.watermark = 0
+        self.done_above: set = set()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            state = json.load(f)
+        self.watermark = state.get('watermark', 0)
+        self.done_above = set(state.get('done_above', []))
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'watermark': self.watermark, 'done_above': sorted(self.done_above)}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def is_done(self, index: int) -> bool:
+        return index < self.watermark or index in self.done_above
+
+    def mark_done(self, index: int):
+        self.done_above.add(index)
+        while self.watermark in self.done_above:
+            self.done_above.remove(self.watermark)
+            self.watermark += 1
+
+
+class BatchStats:
+    def __init__(self) -> None:
+        self.started_at = time.monotonic()
+        self.completed = 0
+        self.errors = 0
+        self.skipped = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def record(self, error: bool, usage: Optional[Dict[str, int]] = None):
+        self.completed += 1
+        if error:
+            self.errors += 1
+        if usage:
+            self.prompt_tokens += usage.get('prompt_tokens', 0)
+            self.completion_tokens += usage.get('completion_tokens', 0)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        return self.completed / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.completed if self.completed else 0.0
+
+    def __str__(self) -> str:
+        return (f"completed={self.completed} skipped={self.skipped} errors={self.errors} "
+                f"error_rate={self.error_rate:.2%} throughput={self.throughput:.2f}/s "
+                f"prompt_tokens={self.prompt_tokens} completion_tokens={self.completion_tokens} "
+                f"elapsed={self.elapsed:.1f}s")
+
+
+def iter_lines(path: str) -> Generator[Tuple[int, str], None, None]:
+    """lazily yields (line index, stripped line) from a file"""
+    with open(path) as f:
+        for index, line in enumerate(f):
+            yield index, line.strip()
+
+
+def iter_input(source: Union[str, Iterable]) -> Generator[Tuple[int, Any], None, None]:
+    """yields (index, item) from a JSONL file path or from an iterable of prompts, records or JSON lines"""
+    if isinstance(source, str):
+        yield from iter_lines(source)
+        return
+    for index, item in enumerate(source):
+        yield index, item.strip() if isinstance(item, str) else item
+
+
+def record_to_prompt(record: Dict[str, Any]) -> BasePrompt:
+    """builds a prompt from a record with either a 'prompt' string or a 'messages' list of role/content dicts"""
+    if 'prompt' not in record and 'messages' not in record:
+        raise ValueError("Batch record must contain a 'prompt' or 'messages' field")
+    return ChatPrompt.from_record(record)
+
+
+class BatchRunner:
+    """Runs a JSONL file of prompts through the generators with bounded concurrency.
+
+    Results are appended to the output JSONL as they complete and progress is checkpointed
+    next to it, so a restarted run skips the lines that were already finished. Delivery is
+    at least once, lines finished after the last checkpoint may appear twice in the output.
+
+    Args:
+        input_path (str | Iterable): the JSONL file of prompts, or an iterable of prompts, records or JSON lines,
+            e.g. ChatPrompt.from_records(...), which is consumed lazily as slots free up
+        output_path (str): the JSONL file the results are appended to
+        checkpoint_path (str): defaults to output_path + '.checkpoint'
+        concurrency (int): number of requests in flight
+        provider_name (str), model_name (str), temperature (float): defaults for records that do not set them
+        report_interval (float): seconds between progress reports, 0 disables them
+    """
+
+    def __init__(
+        self,
+        input_path: Union[str, Iterable],
+        output_path: str,
+        checkpoint_path: Optional[str] = None,
+        concurrency: int = 8,
+        provider_name: Optional[str] = None,
+        model_name: Optional[str] = None,
+        temperature: float = 0.7,
+        factory: Optional[GeneratorFactory] = None,
+        report_interval: float = 10.0,
+        report_stream: TextIO = sys.stderr,
+        checkpoint_every: int = 100,
+        **generate_kwargs,
+    ) -> None:
+        self.input_path = input_path
+        self.output_path = output_path
+        self.checkpoint = BatchCheckpoint(checkpoint_path or output_path + '.checkpoint')
+        self.concurrency = concurrency
+        self.window = concurrency * 4
+        self.provider_name = provider_name
+        self.model_name = model_name
+        self.temperature = temperature
+        self.factory = factory or GeneratorFactory()
+        self.report_interval = report_interval
+        self.report_stream = report_stream
+        self.checkpoint_every = checkpoint_every
+        self.generate_kwargs = generate_kwargs
+        self.stats = BatchStats()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._slots = threading.Condition(self._lock)
+        self._in_flight = 0
+        self._since_checkpoint = 0
+        # an error writing the output, it stops the run
+        self._failure: Optional[BaseException] = None
+        self._last_report = time.monotonic()
+
+    def get_generator(self, record: Dict[str, Any]) -> ResponseGenerator:
+        # generators keep per call state (e.g. gemini system instructions), so each thread gets its own
+        key = (record.get('provider', self.provider_name), record.get('model', self.model_name),
+               record.get('temperature', self.temperature))
+        generators = getattr(self._local, 'generators', None)
+        if generators is None:
+            generators = self._local.generators = {}
+        if key not in generators:
+            generators[key] = self.factory.create_generator(
+                provider_name=key[0], model_name=key[1], temp=key[2])
+        return generators[key]
+
+    def process(self, index: int, item: Union[str, Dict[str, Any], BasePrompt]) -> Dict[str, Any]:
+        result = {'index': index, 'id': index}
+        try:
+            if isinstance(item, BasePrompt):
+                record, prompt = {}, item
+            else:
+                record = json.loads(item) if isinstance(item, str) else item
+                result['id'] = record.get('id', index)
+                prompt = record_to_prompt(record)
+            generator = self.get_generator(record)
+            response = generator.generate_response(prompt, **self.generate_kwargs)
+            result['model'] = generator.model_name
+            result['text'] = response.text()
+            result['usage'] = response.get_usage()
+        except Exception as e:
+            result['error'] = f"{type(e).__name__}: {e}"
+        return result
+
+    def run(self) -> BatchStats:
+        with open(self.output_path, 'a') as output, ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for index, item in iter_input(self.input_path):
+                if self.checkpoint.is_done(index):
+                    self.stats.skipped += 1
+                    continue
+                if not item:
+                    with self._slots:
+                        self.checkpoint.mark_done(index)
+                    continue
+                with self._slots:
+                    self._slots.wait_for(lambda: self._failure is not None or (
+                        self._in_flight < self.concurrency and index - self.checkpoint.watermark < self.window))
+                    if self._failure is not None:
+                        break
+                    self._in_flight += 1
+                future = executor.submit(self.process, index, item)
+                future.add_done_callback(lambda f, index=index: self._on_done(output, index, f))
+        with self._lock:
+            self.checkpoint.save()
+        if self._failure is not None:
+            raise self._failure
+        self.report(force=True)
+        return self.stats
+
+    def _on_done(self, output: TextIO, index: int, future: Future):
+        with self._slots:
+            try:
+                result = future.result()
+                # values json does not know, e.g. numpy ids, are written as strings
+                output.write(json.dumps(result, default=str) + '\n')
+                output.flush()
+                self.stats.record('error' in result, result.get('usage'))
+                self.checkpoint.mark_done(index)
+                self._since_checkpoint += 1
+                if self._since_checkpoint >= self.checkpoint_every:
+                    self.checkpoint.save()
+                    self._since_checkpoint = 0
+            except BaseException as e:
+                # the line is not marked done, a restarted run picks it up again
+                if self._failure is None:
+                    self._failure = e
+            finally:
+                self._in_flight -= 1
+                self._slots.notify_all()
+        self.report()
+
+    def report(self, force: bool = False):
+        if not self.report_stream or (not force and not self.report_interval):
+            return
+        now = time.monotonic()
+        if not force and now - self._last_report < self.report_interval:
+            return
+        self._last_report = now
+        print(f"[chatfusion batch] {self.stats}", file=self.report_stream, flush=True)
+
+
+def run_batch(input_path: Union[str, Iterable], output_path: str, **kwargs) -> BatchStats:
+    return BatchRunner(input_path, output_path, **kwargs).run()
@@ -0,0 +1,66 @@
+import argparse
+import sys
+from .conf import configure
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='chatfusion')
+    parser.add_argument('--gemini-api-key', default=None)
+    parser.add_argument('--openai-api-key', default=None)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    batch = subparsers.add_parser('batch', help='run a JSONL file of prompts, resumable after a crash')
+    batch.add_argument('input', help='JSONL file, one {"id", "prompt" | "messages", ...} record per line')
+    batch.add_argument('output', help='JSONL file the results are appended to')
+    batch.add_argument('--checkpoint', default=None, help='defaults to OUTPUT.checkpoint')
+    batch.add_argument('--concurrency', type=int, default=8)
+    batch.add_argument('--provider', default=None)
+    batch.add_argument('--model', default=None)
+    batch.add_argument('--temperature', type=float, default=0.7)
+    batch.add_argument('--report-interval', type=float, default=10.0)
+    batch.add_argument('--checkpoint-every', type=int, default=100)
+    batch.add_argument('--retry', action='store_true')
+    batch.set_defaults(func=run_batch_command)
+
+    serve = subparsers.add_parser('serve', help='run an OpenAI compatible HTTP gateway over the registered providers')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8000)
+    serve.add_argument('--max-workers', type=int, default=256, help='threads available for provider calls')
+    serve.add_argument('--max-streams', type=int, default=1024, help='streamed completions served at once, more get a 503')
+    serve.set_defaults(func=run_serve_command)
+    return parser
+
+
+def run_batch_command(args: argparse.Namespace) -> int:
+    from .batch import run_batch
+
+    stats = run_batch(
+        args.input,
+        args.output,
+        checkpoint_path=args.checkpoint,
+        concurrency=args.concurrency,
+        provider_name=args.provider,
+        model_name=args.model,
+        temperature=args.temperature,
+        report_interval=args.report_interval,
+        checkpoint_every=args.checkpoint_every,
+        retry=args.retry,
+    )
+    return 1 if stats.errors else 0
+
+
+def run_serve_command(args: argparse.Namespace) -> int:
+    from .gateway import serve
+
+    serve(args.host, args.port, max_workers=args.max_workers, max_streams=args.max_streams)
+    return 0
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    configure(gemini_api_key=args.gemini_api_key, openai_api_key=args.openai_api_key)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+from .types import Callable, List, Optional, Tuple, TYPE_CHECKING
+from .prompts.prompts import ChatPrompt
+from .prompts.parts import Message, SystemMessage, Text, File, ToolMessage, ToolCallMessage
+if TYPE_CHECKING:
+    from .factories import GeneratorFactory
+    from .generators import ResponseGenerator
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Update the summary with the new messages, keeping every fact, decision, name, number and open question "
+    "that later turns may depend on. Reply with the updated summary only."
+)
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+
+def message_text(message: Message) -> str:
+    content = message.get_content()
+    parts = content if isinstance(content, list) else [content]
+    texts = []
+    for part in parts:
+        if isinstance(part, Text):
+            texts.append(part.content)
+        elif isinstance(part, File):
+            texts.append(f"[file {part.id} {part.type}]")
+        else:
+            texts.append(str(part))
+    if isinstance(message, ToolCallMessage):
+        texts += [f"[calls {call}]" for call in message.tool_calls]
+    return ' '.join(text for text in texts if text)
+
+
+def estimate_tokens(message: Message) -> int:
+    """a rough token count, 4 characters per token plus a flat cost for files"""
+    content = message.get_content()
+    parts = content if isinstance(content, list) else [content]
+    files = sum(1 for part in parts if isinstance(part, File))
+    return len(message_text(message)) // 4 + files * 258 + 4
+
+
+class HistoryCompactor:
+    """Replaces the older turns of long chat prompts with a rolling summary made by a cheap model.
+
+    Once a prompt goes over max_tokens, every turn except the system messages and the keep_recent
+    latest ones is summarized. Summaries are cached by a hash chain over the summarized turns, so
+    when more turns age out the cached summary of the longest known prefix is extended with just
+    the new turns instead of summarizing the whole history again.
+
+    Args:
+        max_tokens (int): history size that triggers compaction
+        keep_recent (int): number of latest non system messages always kept verbatim
+        provider_name (str), model_name (str): the summarizing model, created through the factory
+        generator (ResponseGenerator): use this generator for summaries instead of creating one
+        token_counter (Callable[[Message], int]): defaults to estimate_tokens
+        max_cache_entries (int): how many summaries are kept
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 8000,
+        keep_recent: int = 6,
+        provider_name: Optional[str] = None,
+        model_name: Optional[str] = None,
+        generator: Optional['ResponseGenerator'] = None,
+        factory: Optional['GeneratorFactory'] = None,
+        token_counter: Callable[[Message], int] = estimate_tokens,
+        max_cache_entries: int = 1024,
+    ) -> None:
+        if keep_recent < 0:
+            raise ValueError("keep_recent must be 0 or more")
+        self.max_tokens = max_tokens
+        self.keep_recent = keep_recent
+        self.provider_name = provider_name
+        self.model_name = model_name
+        self._generator = generator
+        self.factory = factory
+        self.token_counter = token_counter
+        self.max_cache_entries = max_cache_entries
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+    @property
+    def generator(self) -> 'ResponseGenerator':
+        if self._generator is None:
+            from .factories import GeneratorFactory
+
+            factory = self.factory or GeneratorFactory()
+            self._generator = factory.create_generator(self.provider_name, self.model_name, temp=0.0)
+        return self._generator
+
+    def compact(self, prompt: ChatPrompt) -> ChatPrompt:
+        """returns the prompt unchanged if it is under max_tokens, otherwise a compacted copy"""
+        messages = prompt.get_content()
+        if sum(self.token_counter(message) for message in messages) <= self.max_tokens:
+            return prompt
+        system = [message for message in messages if message.get_role() == 'system']
+        turns = [message for message in messages if message.get_role() != 'system']
+        split = self.find_split(turns)
+        if split <= 0:
+            return prompt
+        summary = self.summarize(turns[:split])
+        return ChatPrompt(system + [SystemMessage(SUMMARY_PREFIX + summary)] + turns[split:])
+
+    def find_split(self, turns: List[Message]) -> int:
+        split = max(0, len(turns) - self.keep_recent)
+        # a tool result must stay next to the call that asked for it, with keep_recent 0 every turn goes
+        while 0 < split < len(turns) and isinstance(turns[split], ToolMessage):
+            split -= 1
+        return split
+
+    def summarize(self, turns: List[Message]) -> str:
+        hashes = self.hash_chain(turns)
+        summary, known = self.longest_cached(hashes)
+        if known == len(turns):
+            return summary
+        summary = self.extend_summary(summary, turns[known:])
+        with self._lock:
+            self._cache[hashes[-1]] = summary
+            while len(self._cache) > self.max_cache_entries:
+                self._cache.popitem(last=False)
+        return summary
+
+    def hash_chain(self, turns: List[Message]) -> List[str]:
+        """hashes[i] identifies the first i + 1 turns"""
+        hashes = []
+        digest = ''
+        for message in turns:
+            digest = hashlib.sha256(f"{digest}\0{message.get_role()}\0{message_text(message)}".encode()).hexdigest()
+            hashes.append(digest)
+        return hashes
+
+    def longest_cached(self, hashes: List[str]) -> Tuple[str, int]:
+        with self._lock:
+            for i in range(len(hashes) - 1, -1, -1):
+                if hashes[i] in self._cache:
+                    self._cache.move_to_end(hashes[i])
+                    return self._cache[hashes[i]], i + 1
+        return '', 0
+
+    def extend_summary(self, summary: str, turns: List[Message]) -> str:
+        transcript = '\n'.join(f"{message.get_role()}: {message_text(message)}" for message in turns)
+        prompt = ChatPrompt().system(SUMMARY_INSTRUCTIONS).user(
+            f"Current summary:\n{summary or '(empty)'}\n\nNew messages:\n{transcript}")
+        return self.generator.generate_response(prompt).text().strip()
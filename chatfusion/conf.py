@@ -1,6 +1,7 @@
-from .types import Optional
+from .types import Iterable, Optional
 import os
-from .model_registry import openai, genai, models, register_openai_default_provider, register_gemini_default_provider
+from .model_registry import openai, genai, models, register_openai_default_provider, register_gemini_default_provider, \
+    openai_provider, gemini_provider
 # Default configuration
 
 
@@ -18,6 +19,18 @@ class ChatConfig:
         openai.api_key = key
         os.environ.setdefault('OPENAI_API_KEY', key)
 
+    @staticmethod
+    def set_openai_keys(keys: Iterable[str], **pool_kwargs):
+        """spreads openai requests over a pool of keys, see KeyPool for the pool_kwargs"""
+        from .key_pool import KeyPool, openai_client
+        openai_provider.set_key_pool(KeyPool(keys, openai_client, **pool_kwargs))
+
+    @staticmethod
+    def set_gemini_keys(keys: Iterable[str], **pool_kwargs):
+        """spreads gemini requests over a pool of keys, each with its own client instead of the global configuration"""
+        from .key_pool import KeyPool, gemini_client
+        gemini_provider.set_key_pool(KeyPool(keys, gemini_client, **pool_kwargs))
+
 chat_config = ChatConfig
 
 def configure(
@@ -25,6 +38,8 @@ def configure(
     api_provider: Optional[str] = None,
     gemini_api_key: Optional[str] = None,
     openai_api_key: Optional[str] = None,
+    gemini_api_keys: Optional[Iterable[str]] = None,
+    openai_api_keys: Optional[Iterable[str]] = None,
     **kwargs
 ):
     
@@ -34,6 +49,12 @@ def configure(
         chat_config.set_gemini_key(gemini_api_key)
     if openai_api_key is not None:
         chat_config.set_openai_key(openai_api_key)
+
+    key_pool_options = kwargs.get('key_pool_options', None) or {}
+    if gemini_api_keys is not None:
+        chat_config.set_gemini_keys(gemini_api_keys, **key_pool_options)
+    if openai_api_keys is not None:
+        chat_config.set_openai_keys(openai_api_keys, **key_pool_options)
         
     gemini_model = kwargs.get('gemini_model', None)
     if gemini_model is not None:
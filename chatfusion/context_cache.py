@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+import datetime
+import hashlib
+import time
+from abc import ABC, abstractmethod
+from threading import Lock
+from uuid import uuid4
+from .types import Any, Dict, List, Optional
+from .model_registry import genai
+from .prompts.parts import File, Text, Part
+from .exceptions import MissingLMLibs
+
+# what gemini bills for an image, and what other inline media are assumed to cost
+IMAGE_TOKENS = 258
+
+
+class ContextHandle:
+    """a reference to a prompt prefix cached by the provider"""
+
+    def __init__(self, name: str, model_name: str, expires_at: float, content: Any = None) -> None:
+        self.name = name
+        self.model_name = model_name
+        self.expires_at = expires_at
+        # the provider object backing the handle, e.g. a genai CachedContent
+        self.content = content
+
+    def expires_in(self) -> float:
+        return self.expires_at - time.time()
+
+
+class ContextCacheBackend(ABC):
+    @abstractmethod
+    def create(self, model_name: str, system_instruction: Any, contents: List[Any], ttl: float) -> ContextHandle:
+        pass
+
+    @abstractmethod
+    def refresh(self, handle: ContextHandle, ttl: float) -> ContextHandle:
+        pass
+
+    @abstractmethod
+    def delete(self, handle: ContextHandle):
+        pass
+
+    @abstractmethod
+    def get_model(self, handle: ContextHandle) -> Any:
+        """returns a model object whose generate_content uses the cached prefix"""
+        pass
+
+    def bind(self, clients: Any) -> 'ContextCacheBackend':
+        """the backend to use with the clients of one key of a KeyPool, caches belong to the key that created them"""
+        return self
+
+
+class GeminiContextCacheBackend(ContextCacheBackend):
+    """creates gemini cached contents, with the global genai config or with cache_client when given"""
+
+    def __init__(self, cache_client: Any = None) -> None:
+        if genai is None:
+            raise MissingLMLibs("Missing Gemini Libs, install google's generativeai")
+        self.cache_client = cache_client
+
+    def bind(self, clients: Any) -> 'GeminiContextCacheBackend':
+        return GeminiContextCacheBackend(clients.caching)
+
+    def create(self, model_name: str, system_instruction: Any, contents: List[Any], ttl: float) -> ContextHandle:
+        model = model_name if model_name.startswith('models/') else f"models/{model_name}"
+        options = dict(
+            system_instruction=system_instruction,
+            contents=contents or None,
+            ttl=datetime.timedelta(seconds=ttl),
+        )
+        if self.cache_client is None:
+            cached = genai.caching.CachedContent.create(model=model, **options)
+        else:
+            request = genai.caching.CachedContent._prepare_create_request(model=model, **options)
+            cached = genai.caching.CachedContent._from_obj(self.cache_client.create_cached_content(request))
+        return ContextHandle(cached.name, model_name, cached.expire_time.timestamp(), cached)
+
+    def refresh(self, handle: ContextHandle, ttl: float) -> ContextHandle:
+        if self.cache_client is None:
+            handle.content.update(ttl=datetime.timedelta(seconds=ttl))
+        else:
+            from google.protobuf import field_mask_pb2
+            request = genai.protos.UpdateCachedContentRequest(
+                cached_content=genai.protos.CachedContent(name=handle.name, ttl=datetime.timedelta(seconds=ttl)),
+                update_mask=field_mask_pb2.FieldMask(paths=['ttl']),
+            )
+            handle.content._update(self.cache_client.update_cached_content(request))
+        handle.expires_at = handle.content.expire_time.timestamp()
+        return handle
+
+    def delete(self, handle: ContextHandle):
+        if self.cache_client is None:
+            handle.content.delete()
+        else:
+            self.cache_client.delete_cached_content(genai.protos.DeleteCachedContentRequest(name=handle.name))
+
+    def get_model(self, handle: ContextHandle) -> Any:
+        return genai.GenerativeModel.from_cached_content(cached_content=handle.content)
+
+
+class LocalContextCacheBackend(ContextCacheBackend):
+    """an in process stand in for the provider cache, for tests and local development
+
+    get_model wraps the given model factory so the cached prefix is prepended to every request,
+    which is what the provider does server side.
+    """
+
+    def __init__(self, model_factory=None) -> None:
+        self.model_factory = model_factory
+        self.store: Dict[str, Dict[str, Any]] = {}
+        self.created = 0
+        self.refreshed = 0
+
+    def create(self, model_name: str, system_instruction: Any, contents: List[Any], ttl: float) -> ContextHandle:
+        name = f"cachedContents/{uuid4().hex}"
+        self.store[name] = {'system_instruction': system_instruction, 'contents': list(contents)}
+        self.created += 1
+        return ContextHandle(name, model_name, time.time() + ttl, self.store[name])
+
+    def refresh(self, handle: ContextHandle, ttl: float) -> ContextHandle:
+        if handle.name not in self.store:
+            raise KeyError(f"{handle.name} does not exist")
+        self.refreshed += 1
+        handle.expires_at = time.time() + ttl
+        return handle
+
+    def delete(self, handle: ContextHandle):
+        self.store.pop(handle.name, None)
+
+    def get_model(self, handle: ContextHandle) -> Any:
+        if self.model_factory is None:
+            raise ValueError("LocalContextCacheBackend needs a model_factory to build models")
+        return self.model_factory(handle.model_name, **self.store[handle.name])
+
+
+def part_key(part: Part) -> str:
+    if isinstance(part, Text):
+        return 'text:' + hashlib.sha256(part.content.encode()).hexdigest()
+    if isinstance(part, File):
+        if part.inline:
+            digest = getattr(part, '_content_hash', None) or hashlib.sha256(part.data).hexdigest()
+            part._content_hash = digest
+            return 'data:' + digest
+        return 'file:' + part.id
+    return 'part:' + hashlib.sha256(str(part).encode()).hexdigest()
+
+
+class ContextCacheRegistry:
+    """Keeps handles to provider cached prompt prefixes, keyed by the model and the content of the prefix.
+
+    A handle is created the first time a prefix big enough to be worth caching is seen, reused by
+    later requests, and refreshed when it gets within refresh_margin seconds of expiring.
+
+    Args:
+        backend (ContextCacheBackend): defaults to the Gemini backend
+        ttl (float): lifetime of created and refreshed caches in seconds
+        refresh_margin (float): refresh a handle when it expires sooner than this
+        min_tokens (int): prefixes estimated to be smaller are not cached, gemini rejects small caches
+    """
+
+    def __init__(
+        self,
+        backend: Optional[ContextCacheBackend] = None,
+        ttl: float = 3600,
+        refresh_margin: float = 300,
+        min_tokens: int = 32768,
+    ) -> None:
+        self.backend = backend or GeminiContextCacheBackend()
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.min_tokens = min_tokens
+        self.handles: Dict[str, ContextHandle] = {}
+        # the keys of the prefixes the provider refused to cache
+        self.rejected = set()
+        # the registries of the keys of a KeyPool, by key
+        self.bound: Dict[str, 'ContextCacheRegistry'] = {}
+        self._lock = Lock()
+
+    def bind(self, clients: Any) -> 'ContextCacheRegistry':
+        """the registry to use with the clients of one key, with the same settings and its own handles"""
+        with self._lock:
+            registry = self.bound.get(clients.key)
+            if registry is None:
+                registry = ContextCacheRegistry(self.backend.bind(clients), self.ttl, self.refresh_margin, self.min_tokens)
+                self.bound[clients.key] = registry
+            return registry
+
+    def prefix_key(self, model_name: str, parts: List[Part]) -> str:
+        digest = hashlib.sha256(model_name.encode())
+        for part in parts:
+            digest.update(b'\0' + part_key(part).encode())
+        return digest.hexdigest()
+
+    def estimate_tokens(self, parts: List[Part]) -> int:
+        tokens = 0
+        for part in parts:
+            if isinstance(part, Text):
+                tokens += len(part.content) // 4
+            elif isinstance(part, File):
+                file_type = part.type or ''
+                if file_type.startswith('image/'):
+                    # gemini bills an image at a flat rate whatever its size in bytes
+                    tokens += IMAGE_TOKENS
+                elif not part.inline:
+                    # other uploaded files are assumed big enough, that is why they were uploaded,
+                    # a prefix the provider rejects as too small is remembered by get_handle
+                    tokens += self.min_tokens
+                elif file_type.startswith('text/'):
+                    tokens += len(part.data) // 4
+                else:
+                    tokens += IMAGE_TOKENS
+        return tokens
+
+    def get_handle(self, model_name: str, parts: List[Part], system_instruction: Any, contents: List[Any]) -> Optional[ContextHandle]:
+        """
+        returns a live handle for the prefix, creating or refreshing it as needed,
+        None if it is too small to cache or the provider failed to cache it
+        """
+        if self.estimate_tokens(parts) < self.min_tokens:
+            return None
+        key = self.prefix_key(model_name, parts)
+        with self._lock:
+            if key in self.rejected:
+                return None
+            handle = self.handles.get(key)
+            if handle is not None and handle.expires_in() <= 0:
+                self.handles.pop(key)
+                handle = None
+            if handle is not None and handle.expires_in() >= self.refresh_margin:
+                return handle
+        # the provider calls are made outside the lock so a slow one does not hold up other prefixes
+        if handle is not None:
+            try:
+                return self.backend.refresh(handle, self.ttl)
+            except Exception:
+                # the cache may have been deleted on the provider side
+                pass
+        try:
+            created = self.backend.create(model_name, system_instruction, contents, self.ttl)
+        except Exception as e:
+            # a 400 is the provider rejecting the prefix, e.g. below its minimum size, it is not retried
+            if getattr(e, 'code', None) == 400:
+                with self._lock:
+                    self.rejected.add(key)
+            return None
+        with self._lock:
+            current = self.handles.get(key)
+            if current is None or current is handle or current.expires_in() <= 0:
+                self.handles[key] = created
+                return created
+        # another request created the same prefix meanwhile
+        self.backend.delete(created)
+        return current
+
+    def evict_expired(self):
+        with self._lock:
+            for key in [key for key, handle in self.handles.items() if handle.expires_in() <= 0]:
+                self.handles.pop(key)
+            bound = list(self.bound.values())
+        for registry in bound:
+            registry.evict_expired()
+
+    def clear(self, delete: bool = True):
+        with self._lock:
+            handles, self.handles = list(self.handles.values()), {}
+            self.rejected.clear()
+            bound = list(self.bound.values())
+        if delete:
+            for handle in handles:
+                self.backend.delete(handle)
+        for registry in bound:
+            registry.clear(delete)
@@ -0,0 +1,60 @@
+from abc import ABC, abstractmethod
+from typing import Iterable, List
+from .model_registry import genai, openai
+from .exceptions import MissingLMLibs
+
+
+class EmbeddingGenerator(ABC):
+    """Turns texts into embedding vectors, batching the requests to the provider"""
+
+    batch_size: int = 100
+
+    def __init__(self, model_name: str, batch_size: int = None) -> None:
+        self.model_name = model_name
+        if batch_size is not None:
+            self.batch_size = batch_size
+
+    def embed(self, texts: Iterable[str]) -> List[List[float]]:
+        """embeds the texts in batches of batch_size, order is preserved"""
+        texts = list(texts)
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors += self.embed_batch(texts[start:start + self.batch_size])
+        return vectors
+
+    def embed_one(self, text: str) -> List[float]:
+        return self.embed_batch([text])[0]
+
+    @abstractmethod
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        pass
+
+
+class OpenAiEmbeddingGenerator(EmbeddingGenerator):
+    batch_size = 2048
+
+    def __init__(self, model_name: str = 'text-embedding-3-small', batch_size: int = None, client=None, **kwargs) -> None:
+        if not openai:
+            raise MissingLMLibs("Missing OpenAI Libs, install openai package")
+        super().__init__(model_name, batch_size)
+        self.client = client if client is not None else openai.OpenAI(**kwargs)
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        response = self.client.embeddings.create(model=self.model_name, input=texts)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+class GeminiEmbeddingGenerator(EmbeddingGenerator):
+    batch_size = 100
+
+    def __init__(self, model_name: str = 'text-embedding-004', batch_size: int = None, client=None) -> None:
+        if genai is None:
+            raise MissingLMLibs("Missing Gemini Libs, install google's generativeai")
+        super().__init__(model_name, batch_size)
+        # the clients of one key of a KeyPool, the global genai config is used without them
+        self.client = client
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        model = self.model_name if self.model_name.startswith('models/') else f"models/{self.model_name}"
+        client = self.client.generative if self.client is not None else None
+        return genai.embed_content(model=model, content=texts, client=client)['embedding']
@@ -20,4 +20,19 @@ class UnexpectedBehavior(Exception):
 class ForbiddenException(Exception):
     def __init__(self, *args: object) -> None:
         newargs = ['Forbidden action performed'] + list(args)
-        super().__init__(*newargs)
\ No newline at end of file
+        super().__init__(*newargs)
+
+class InvalidStructuredOutput(ValueError):
+    def __init__(self, message: str, path: str = '$') -> None:
+        self.message = message
+        self.path = path
+        super().__init__(f"Invalid structured output at {path}: {message}")
+
+class DeadlineExceeded(TimeoutError):
+    def __init__(self, message: str = "the request deadline passed", stage: str = 'queued') -> None:
+        self.stage = stage
+        super().__init__(f"{message} while {stage}")
+
+class NoKeyAvailable(RuntimeError):
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
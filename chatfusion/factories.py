@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 from .generators import ResponseGenerator
+from .embeddings import EmbeddingGenerator
+from .key_pool import PooledGenerator, PooledEmbeddingGenerator
 from typing import Type
 from .model_registry import models, Provider, ModelRegistry
 from .exceptions import ModelNotFoundException
@@ -10,16 +12,18 @@ class GeneratorFactory:
     def __init__(self, registry: ModelRegistry = models):
         self.registry = registry
 
-    def create_generator(self, provider_name: str= None, model_name: str = None, temp: float=0.7) -> ResponseGenerator:
+    def create_generator(self, provider_name: str= None, model_name: str = None, temp: float=0.7, **kwargs) -> ResponseGenerator:
         generator_class = None
         
         if provider_name is not None:
-            generator_class = self.get_generator_class(self.registry.get_provider(provider_name))
+            provider = self.registry.get_provider(provider_name)
+            generator_class = self.get_generator_class(provider)
             if model_name is None:
-                model_name = self.registry.get_provider(provider_name).default_model
+                model_name = provider.default_model
         elif model_name is not None:
+            provider = self.get_provider(model_name)
             try:
-                generator_class = self.get_generator_class(self.get_provider(model_name))
+                generator_class = self.get_generator_class(provider)
             except AttributeError:
                 raise ModelNotFoundException("Gemini model not found make sure to update the gemini models if your model is not in the default ones")
         else:
@@ -29,8 +33,14 @@ class GeneratorFactory:
             
         if generator_class is None:
             raise ValueError('Could not Find a Response Generator for this model.')
-        
-        return generator_class(model_name=model_name, temperature=temp)
+
+        key_pool = provider.get_key_pool()
+        if key_pool is not None and 'client' not in kwargs:
+            return PooledGenerator(
+                key_pool,
+                lambda client: generator_class(model_name=model_name, temperature=temp, client=client, **kwargs)
+            )
+        return generator_class(model_name=model_name, temperature=temp, **kwargs)
     
     def get_provider(self, model_name: str) -> str:
         return self.registry.get_provider_by_model_name(model_name)
@@ -38,3 +48,18 @@ class GeneratorFactory:
     def get_generator_class(self, provider: Provider) -> Type[ResponseGenerator]:
         return provider.get_generator()
 
+    def create_embedder(self, provider_name: str = None, model_name: str = None, **kwargs) -> EmbeddingGenerator:
+        provider = self.registry.get_provider(provider_name) if provider_name else self.registry.default_provider
+        if provider is None:
+            raise ModelNotFoundException(f"provider {provider_name} is not registered")
+        embedder_class = provider.get_embedder()
+        if embedder_class is None:
+            raise ValueError(f'Provider {provider.name} does not support embeddings.')
+        model_name = model_name or provider.default_embedding_model
+        key_pool = provider.get_key_pool()
+        if key_pool is not None and 'client' not in kwargs:
+            return PooledEmbeddingGenerator(
+                key_pool,
+                lambda client: embedder_class(model_name=model_name, client=client, **kwargs)
+            )
+        return embedder_class(model_name=model_name, **kwargs)
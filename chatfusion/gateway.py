@@ -0,0 +1,396 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+from .types import Any, Dict, List, Optional, Tuple
+from .factories import GeneratorFactory
+from .model_registry import ModelRegistry, models
+from .generators import ResponseGenerator
+from .prompts.prompts import Prompt, ChatPrompt
+from .exceptions import ModelNotFoundException, BadInputException
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, error_type: str = 'invalid_request_error') -> None:
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.error_type = error_type
+
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            413: 'Payload Too Large', 500: 'Internal Server Error', 502: 'Bad Gateway', 503: 'Service Unavailable'}
+
+
+class RouteStats:
+    """latency and throughput of one route, percentiles are computed over the most recent requests"""
+
+    def __init__(self, window: int = 1000) -> None:
+        self.started_at = time.monotonic()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.total_latency = 0.0
+        self.latencies = deque(maxlen=window)
+
+    def start(self) -> float:
+        self.in_flight += 1
+        return time.monotonic()
+
+    def finish(self, started: float, error: bool = False):
+        latency = time.monotonic() - started
+        self.in_flight -= 1
+        self.requests += 1
+        self.errors += int(error)
+        self.total_latency += latency
+        self.latencies.append(latency)
+
+    def percentile(self, q: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.started_at
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'in_flight': self.in_flight,
+            'throughput': self.requests / elapsed if elapsed else 0.0,
+            'latency_avg': self.total_latency / self.requests if self.requests else 0.0,
+            'latency_p50': self.percentile(0.5),
+            'latency_p95': self.percentile(0.95),
+            'latency_p99': self.percentile(0.99),
+        }
+
+
+# provider neutral finish reasons of Response.get_finish_reason to openai ones
+_FINISH_REASONS = {
+    'STOP': 'stop',
+    'MAX_TOKENS': 'length',
+    'SAFETY': 'content_filter',
+    'RECITATION': 'content_filter',
+    'BLOCKLIST': 'content_filter',
+    'PROHIBITED_CONTENT': 'content_filter',
+    'SPII': 'content_filter',
+    'TOOL_CALL': 'tool_calls',
+    'FUNCTION_CALL': 'function_call',
+    # the stream was ended on our side, by a stop condition or a cancel
+    'CLIENT_STOP': 'stop',
+    'CANCELLED': 'stop',
+}
+
+# request parameters passed on to generate_response, others are ignored
+PASSTHROUGH_PARAMS = ('max_tokens', 'stop', 'top_p', 'presence_penalty', 'frequency_penalty')
+
+
+def finish_reason(reason: Optional[str]) -> str:
+    return _FINISH_REASONS.get(reason, 'stop')
+
+
+def choice_content(response, index: int) -> Optional[str]:
+    """the text of a choice whatever its finish reason, None if the provider returned no text"""
+    try:
+        return response.get_choice_content(response.get_choice(index))
+    except (AttributeError, IndexError):
+        return None
+
+
+def messages_to_prompt(messages: List[Dict[str, Any]]) -> ChatPrompt:
+    """converts OpenAI style chat messages into a ChatPrompt, only text content is supported"""
+    prompt = Prompt().chat()
+    for message in messages:
+        content = message.get('content') or ''
+        if isinstance(content, list):
+            content = [item['text'] for item in content if item.get('type') == 'text']
+        prompt = prompt.message(message.get('role', 'user'), content)
+    return prompt
+
+
+class Gateway:
+    """An asyncio HTTP server exposing an OpenAI compatible chat completions endpoint over the registered providers.
+
+    Generators are blocking, so provider calls run in a thread pool while the event loop only
+    handles connections and streaming. Each worker thread keeps its own generators. A streamed
+    completion holds a thread of a separate pool until the stream ends, so at most max_streams
+    streams are served at the same time and the next ones are answered with a 503 rather than
+    queued. Non streamed requests share max_workers threads and wait for a free one.
+
+    Routes:
+        POST /v1/chat/completions: with "stream": true the response is sent as server sent events
+        GET /v1/models
+        GET /stats: per route latency and throughput
+    """
+
+    max_body_size = 16 * 1024 * 1024
+
+    def __init__(
+        self,
+        host: str = '127.0.0.1',
+        port: int = 8000,
+        registry: ModelRegistry = models,
+        factory: Optional[GeneratorFactory] = None,
+        max_workers: int = 256,
+        max_streams: int = 1024,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.factory = factory or GeneratorFactory(registry)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chatfusion-gateway')
+        self.max_streams = max_streams
+        self.stream_executor = ThreadPoolExecutor(max_workers=max_streams, thread_name_prefix='chatfusion-gateway-stream')
+        # streams in flight, only touched from the event loop
+        self._streams = 0
+        self.stats: Dict[str, RouteStats] = {}
+        self.routes = {
+            ('POST', '/v1/chat/completions'): self.chat_completions,
+            ('GET', '/v1/models'): self.list_models,
+            ('GET', '/stats'): self.get_stats,
+        }
+        self._local = threading.local()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> asyncio.AbstractServer:
+        self._server = await asyncio.start_server(self.handle_connection, self.host, self.port, limit=self.max_body_size)
+        return self._server
+
+    async def serve_forever(self):
+        server = await self.start()
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        asyncio.run(self.serve_forever())
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self.executor.shutdown(wait=False)
+        self.stream_executor.shutdown(wait=False)
+
+    def get_generator(self, model_name: str, temperature: float) -> ResponseGenerator:
+        generators = getattr(self._local, 'generators', None)
+        if generators is None:
+            generators = self._local.generators = {}
+        key = (model_name, temperature)
+        if key not in generators:
+            if self.registry.get_provider_by_model_name(model_name) is None:
+                raise ModelNotFoundException(f"model {model_name} is not registered")
+            generators[key] = self.factory.create_generator(model_name=model_name, temp=temperature)
+        return generators[key]
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                keep_alive = await self.dispatch(method, path, body, writer) and keep_alive
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except HTTPError as e:
+            await self.send_error(writer, e)
+        finally:
+            writer.close()
+
+    async def read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            raise HTTPError(400, 'malformed request line')
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0) or 0)
+        if length > self.max_body_size:
+            raise HTTPError(413, 'request body too large')
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), target.split('?', 1)[0], headers, body
+
+    async def dispatch(self, method: str, path: str, body: bytes, writer: asyncio.StreamWriter) -> bool:
+        """handles one request, returns whether the connection can be kept alive"""
+        handler = self.routes.get((method, path))
+        route = f"{method} {path}" if handler else 'unmatched'
+        stats = self.stats.setdefault(route, RouteStats())
+        started = stats.start()
+        error = True
+        try:
+            if handler is None:
+                allowed = any(p == path for _, p in self.routes)
+                raise HTTPError(405 if allowed else 404, f"no route for {method} {path}")
+            keep_alive = await handler(body, writer)
+            error = False
+            return keep_alive
+        except HTTPError as e:
+            await self.send_error(writer, e)
+            return True
+        except (ModelNotFoundException, BadInputException, ValueError) as e:
+            await self.send_error(writer, HTTPError(400, str(e)))
+            return True
+        except ConnectionError:
+            return False
+        except Exception as e:
+            await self.send_error(writer, HTTPError(502, f"{type(e).__name__}: {e}", 'provider_error'))
+            return True
+        finally:
+            stats.finish(started, error)
+
+    async def chat_completions(self, body: bytes, writer: asyncio.StreamWriter) -> bool:
+        try:
+            payload = json.loads(body or b'{}')
+        except json.JSONDecodeError:
+            raise HTTPError(400, 'request body is not valid JSON')
+        model_name = payload.get('model') or self.registry.default_provider.default_model
+        messages = payload.get('messages')
+        if not messages:
+            raise HTTPError(400, "'messages' is required")
+        temperature = payload.get('temperature', 0.7)
+        prompt = messages_to_prompt(messages)
+        kwargs = {name: payload[name] for name in PASSTHROUGH_PARAMS if payload.get(name) is not None}
+        if payload.get('max_completion_tokens') is not None:
+            kwargs.setdefault('max_tokens', payload['max_completion_tokens'])
+        if payload.get('n'):
+            kwargs['choice_count'] = payload['n']
+        loop = asyncio.get_running_loop()
+
+        if payload.get('stream'):
+            return await self.stream_completion(model_name, temperature, prompt, kwargs, writer)
+
+        def call():
+            generator = self.get_generator(model_name, temperature)
+            response = generator.generate_response(prompt, **kwargs)
+            choices = [(choice_content(response, i), finish_reason(response.get_finish_reason(response.get_choice(i))))
+                       for i in range(len(response))]
+            return choices, response.get_usage()
+
+        choices, usage = await loop.run_in_executor(self.executor, call)
+        await self.send_json(writer, 200, {
+            'id': f"chatcmpl-{uuid4().hex}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model_name,
+            'choices': [{'index': i, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': reason}
+                        for i, (text, reason) in enumerate(choices)],
+            'usage': usage,
+        })
+        return True
+
+    async def stream_completion(self, model_name: str, temperature: float, prompt: ChatPrompt,
+                                kwargs: Dict[str, Any], writer: asyncio.StreamWriter) -> bool:
+        if self._streams >= self.max_streams:
+            raise HTTPError(503, f"the gateway is already serving {self.max_streams} streams, retry later", 'overloaded')
+        self._streams += 1
+        try:
+            return await self._stream_completion(model_name, temperature, prompt, kwargs, writer)
+        finally:
+            self._streams -= 1
+
+    async def _stream_completion(self, model_name: str, temperature: float, prompt: ChatPrompt,
+                                 kwargs: Dict[str, Any], writer: asyncio.StreamWriter) -> bool:
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        cancelled = threading.Event()
+        done = object()
+        streams = []
+
+        def produce():
+            response = None
+            try:
+                generator = self.get_generator(model_name, temperature)
+                response = generator.generate_response(prompt, stream=True, **kwargs)
+                streams.append(response)
+                for text in response.stream_text():
+                    if cancelled.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, text)
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                if response is not None and cancelled.is_set():
+                    response.cancel()
+
+        producer = loop.run_in_executor(self.stream_executor, produce)
+        first = await queue.get()
+        if isinstance(first, Exception):
+            await producer
+            raise first
+
+        completion_id = f"chatcmpl-{uuid4().hex}"
+        created = int(time.time())
+
+        def event(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> bytes:
+            chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model_name,
+                     'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+            return f"data: {json.dumps(chunk)}\n\n".encode()
+
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n'
+                     b'Connection: close\r\n\r\n')
+        writer.write(event({'role': 'assistant', 'content': ''}))
+        item = first
+        try:
+            while item is not done:
+                if isinstance(item, Exception):
+                    error = {'error': {'message': f"{type(item).__name__}: {item}", 'type': 'provider_error'}}
+                    writer.write(f"data: {json.dumps(error)}\n\n".encode())
+                    break
+                writer.write(event({'content': item}))
+                await writer.drain()
+                item = await queue.get()
+            else:
+                writer.write(event({}, finish_reason(streams[0].stream_finish_reason if streams else None)))
+            writer.write(b'data: [DONE]\n\n')
+            await writer.drain()
+        except ConnectionError:
+            # the client went away, close the provider stream now instead of at its next chunk
+            cancelled.set()
+            for response in streams:
+                response.cancel()
+            raise
+        finally:
+            cancelled.set()
+            await producer
+        return False
+
+    async def list_models(self, body: bytes, writer: asyncio.StreamWriter) -> bool:
+        await self.send_json(writer, 200, {
+            'object': 'list',
+            'data': [{'id': model, 'object': 'model', 'owned_by': provider} for model, provider in self.registry.list_models()],
+        })
+        return True
+
+    async def get_stats(self, body: bytes, writer: asyncio.StreamWriter) -> bool:
+        await self.send_json(writer, 200, {route: stats.to_dict() for route, stats in self.stats.items()})
+        return True
+
+    async def send_json(self, writer: asyncio.StreamWriter, status: int, payload: Any):
+        body = json.dumps(payload).encode()
+        writer.write(f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        await writer.drain()
+
+    async def send_error(self, writer: asyncio.StreamWriter, error: HTTPError):
+        await self.send_json(writer, error.status, {'error': {'message': error.message, 'type': error.error_type}})
+
+
+def serve(host: str = '127.0.0.1', port: int = 8000, **kwargs):
+    Gateway(host, port, **kwargs).run()
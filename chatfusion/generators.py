@@ -1,9 +1,17 @@
+import json
 from abc import ABC, abstractmethod
-from typing import Iterable, List
-from .prompts.prompts import BasePrompt, SingleMessagePrompt, ChatPrompt, Text, File, Part, SystemMessage
+from typing import Iterable, List, Optional, TYPE_CHECKING
+from .prompts.prompts import BasePrompt, SingleMessagePrompt, ChatPrompt, Text, File, Part, SystemMessage, Message, ToolCallMessage, ToolMessage
 from .model_registry import genai, openai
-from .responses import OpenAIResponse, GeminiResponse, Response
+from .responses import OpenAIResponse, GeminiResponse, Response, CachedResponse
 from .exceptions import MissingLMLibs, BadInputException
+from .preprocessing import detect_mime_type
+if TYPE_CHECKING:
+    from .preprocessing import ImagePreprocessor
+    from .tools import Tool
+    from .compaction import HistoryCompactor
+    from .semantic_cache import SemanticCache
+    from .context_cache import ContextCacheRegistry
 
 
 class ResponseGenerator(ABC):
@@ -26,9 +34,61 @@ class ResponseGenerator(ABC):
             temperature (float): will override the default
             choice_count (int): how many times should the model generate the content (model/subscription specific) may fail if more than 1 
             retry (bool): whether or not to retry on failure
+            tools (List[Tool]): tools the model may ask to call, see Response.get_tool_calls
+            max_tokens (int), stop (str | List[str]), top_p (float): sampling limits, named as in the openai api
         """
         pass
 
+    image_preprocessor: Optional['ImagePreprocessor'] = None
+    history_compactor: Optional['HistoryCompactor'] = None
+    semantic_cache: Optional['SemanticCache'] = None
+    model_name: str = ''
+
+    def is_cacheable(self, kwargs: dict) -> bool:
+        """whether the semantic cache applies to a request with these generate_response kwargs"""
+        return self.semantic_cache is not None and not kwargs.get('tools') and kwargs.get('choice_count', 1) == 1
+
+    def lookup_cache(self, prompt: 'BasePrompt', streamed: bool) -> Optional[Response]:
+        answer = self.semantic_cache.lookup(prompt, self.model_name)
+        if answer is None:
+            return None
+        return CachedResponse(answer, streamed, self, prompt)
+
+    def store_cache(self, prompt: 'BasePrompt', response: Response):
+        # streamed responses are not stored since their text is consumed by the caller
+        if not response.streamed and response.is_choice_safe() and not response.has_tool_calls():
+            self.semantic_cache.store(prompt, self.model_name, response.text())
+
+    def compact_history(self, prompt: 'BasePrompt') -> 'BasePrompt':
+        if self.history_compactor is None or not isinstance(prompt, ChatPrompt):
+            return prompt
+        return self.history_compactor.compact(prompt)
+
+    def preprocess_files(self, prompt: 'BasePrompt'):
+        """processes all the inline images of the prompt concurrently so handle_file finds them cached"""
+        if self.image_preprocessor is None:
+            return
+        files = [part for part in self.iter_file_parts(prompt.get_content())
+                 if self.image_preprocessor.is_processable(part)]
+        if files:
+            self.image_preprocessor.process_many(files, self.model_name)
+
+    def iter_file_parts(self, parts) -> Iterable[File]:
+        if isinstance(parts, File):
+            yield parts
+        elif isinstance(parts, Message):
+            yield from self.iter_file_parts(parts.get_content())
+        elif isinstance(parts, Iterable) and not isinstance(parts, (str, Part)):
+            for part in parts:
+                yield from self.iter_file_parts(part)
+
+    def get_file_payload(self, file: File) -> tuple:
+        """returns the (mime_type, data, base64_data) that should be sent for an inline file"""
+        if self.image_preprocessor is not None and self.image_preprocessor.is_processable(file):
+            processed = self.image_preprocessor.process(file, self.model_name)
+            return processed.mime_type, processed.data, processed.base64_data
+        return detect_mime_type(file.data, file.type), file.data, file.base64_data
+
 
 class PromptStrategy(ABC):
     @abstractmethod
@@ -37,12 +97,28 @@ class PromptStrategy(ABC):
 
 
 class GeminiGenerator(ResponseGenerator, PromptStrategy):
-    def __init__(self, model_name, temperature=0.7, **kwargs):
+    # openai style parameter names accepted by generate_response and their GenerationConfig names
+    generation_params = {'max_tokens': 'max_output_tokens', 'stop': 'stop_sequences'}
+
+    def __init__(self, model_name, temperature=0.7, image_preprocessor: Optional['ImagePreprocessor'] = None,
+                 history_compactor: Optional['HistoryCompactor'] = None, semantic_cache: Optional['SemanticCache'] = None,
+                 context_cache: Optional['ContextCacheRegistry'] = None, client=None, **kwargs):
         self.response = None
+        self.image_preprocessor = image_preprocessor
+        self.history_compactor = history_compactor
+        self.semantic_cache = semantic_cache
+        self.context_cache = context_cache
+        self._cached_models = {}
         if genai is None:
             raise MissingLMLibs(
                 "Missing Gemini Libs, install google's generativeai")
         self.model = genai.GenerativeModel(model_name=model_name, **kwargs)
+        # the clients of one key of a KeyPool (see key_pool.GeminiClients) used instead of the global ones
+        self.client = client
+        if client is not None:
+            self.model._client = client.generative
+            if context_cache is not None:
+                self.context_cache = context_cache.bind(client)
         self.model_name = model_name
         self.temperature = temperature
         self.response = None
@@ -51,11 +127,31 @@ class GeminiGenerator(ResponseGenerator, PromptStrategy):
         from google.api_core.retry import Retry
         from google.generativeai.generative_models import helper_types
 
+        cacheable = self.is_cacheable(kwargs)
+        if cacheable:
+            cached = self.lookup_cache(prompt, kwargs.get('stream', False))
+            if cached is not None:
+                return cached
+        original_prompt = prompt
+
         candidate_count = kwargs.pop('choice_count', 1)
         temperature = kwargs.pop('temperature', self.temperature)
         retry = kwargs.pop('retry', False)
-
+        self.streamed = kwargs.pop('stream', False)
+        tools = kwargs.pop('tools', None)
+        for name, gemini_name in self.generation_params.items():
+            if name in kwargs:
+                kwargs[gemini_name] = kwargs.pop(name)
+        if isinstance(kwargs.get('stop_sequences'), str):
+            kwargs['stop_sequences'] = [kwargs['stop_sequences']]
+
+        prompt = self.compact_history(prompt)
+        self.preprocess_files(prompt)
         contents, system_instructions = prompt.build_prompt(self)
+        model = self.model
+        if self.context_cache is not None and not tools:
+            # gemini rejects tools on a request that uses cached content
+            model, contents, system_instructions = self.apply_context_cache(prompt, contents, system_instructions)
         if system_instructions:
             self.include_system_instructions(system_instructions)
 
@@ -64,18 +160,20 @@ class GeminiGenerator(ResponseGenerator, PromptStrategy):
         else:
             retry = None
 
-        response = self.model.generate_content(
+        response = model.generate_content(
             contents=contents,
             generation_config=genai.GenerationConfig(
                 temperature=temperature, candidate_count=candidate_count, *args, **kwargs),
             request_options=helper_types.RequestOptions(retry=retry),
-            *args,
-            **kwargs
+            stream=self.streamed,
+            tools=self.serialize_tools(tools) if tools else None,
         )
 
-        self.streamed = kwargs.pop('stream', False)
         self.response = response
-        return GeminiResponse(response, self.streamed, self, prompt)
+        result = GeminiResponse(response, self.streamed, self, prompt)
+        if cacheable:
+            self.store_cache(original_prompt, result)
+        return result
 
     def set_temperature(self, temperature):
         self.temperature = temperature
@@ -91,6 +189,16 @@ class GeminiGenerator(ResponseGenerator, PromptStrategy):
         if isinstance(prompt, ChatPrompt):
             contents = prompt.get_content()
             for message in contents:
+                if isinstance(message, (ToolCallMessage, ToolMessage)):
+                    serialized = self.serialize_tool_message(message)
+                    previous = final[-1]['parts'] if final else None
+                    if isinstance(message, ToolMessage) and isinstance(previous, list) and isinstance(previous[-1], dict) \
+                            and 'function_response' in previous[-1]:
+                        # gemini expects the responses of one turn's calls in a single content
+                        final[-1]['parts'] += serialized['parts']
+                    else:
+                        final.append(serialized)
+                    continue
                 content = self.serialize_many_parts(message.content)
                 messagedict = {
                     'role': self.get_appropriate_role(message.role),
@@ -108,6 +216,20 @@ class GeminiGenerator(ResponseGenerator, PromptStrategy):
         else:
             return 'user'
 
+    def serialize_tools(self, tools: List['Tool']) -> list:
+        return [{'function_declarations': [
+            {'name': tool.name, 'description': tool.description, 'parameters': tool.parameters}
+            for tool in tools
+        ]}]
+
+    def serialize_tool_message(self, message: Message) -> dict:
+        if isinstance(message, ToolCallMessage):
+            parts = [{'function_call': {'name': call.name, 'args': call.arguments}} for call in message.tool_calls]
+            return {'role': 'model', 'parts': parts}
+        return {'role': 'user', 'parts': [
+            {'function_response': {'name': message.name, 'response': {'result': str(message.content)}}}
+        ]}
+
     def serialize_one_part(self, part: Part):
         if isinstance(part, Text):
             return part.content
@@ -120,7 +242,14 @@ class GeminiGenerator(ResponseGenerator, PromptStrategy):
         from google.api_core.exceptions import PermissionDenied
 
         if file.inline:
-            return {'mime_type': file.type, 'data': file.data}
+            mime_type, data, _ = self.get_file_payload(file)
+            return {'mime_type': mime_type, 'data': data}
+        elif self.client is not None:
+            try:
+                return genai.types.File(self.client.files.get_file(name=f"files/{file.id}"))
+            except PermissionDenied:
+                return genai.types.File(self.client.files.create_file(
+                    file.get_path(), mime_type=file.type, name=f"files/{file.id}"))
         else:
             try:
                 gemini_file = genai.get_file(file.id)
@@ -139,31 +268,113 @@ class GeminiGenerator(ResponseGenerator, PromptStrategy):
         return l
 
     def include_system_instructions(self, system_instructions: List[SystemMessage]):
+        self.model._system_instruction = self.serialize_system_instructions(system_instructions)
+
+    def serialize_system_instructions(self, system_instructions: List[SystemMessage]):
         temp = []
         for instruction in system_instructions:
             instruction_content = self.serialize_many_parts(
                 instruction.get_content())
             temp += instruction_content if isinstance(instruction_content, list) else [
                 instruction_content]
-        self.model._system_instruction = genai.types.content_types.to_content(
-            instruction_content)
+        return genai.types.content_types.to_content(
+            temp)
+
+    def apply_context_cache(self, prompt: 'BasePrompt', contents: list, system_instructions: List[SystemMessage]) -> tuple:
+        """
+        moves the stable prefix of the prompt (system messages and the files leading the first message)
+        into a gemini cached content, returns the model to call with the remaining contents
+        and system instructions
+        """
+        if isinstance(prompt, ChatPrompt):
+            first = next((m for m in prompt.get_content() if m.role != 'system'), None)
+            leading = self.leading_files(first.get_content()) if first is not None and not isinstance(
+                first, (ToolCallMessage, ToolMessage)) else []
+            remaining_parts = self.as_list(contents[0]['parts'])[len(leading):] if contents else []
+            if leading and not remaining_parts and len(contents) == 1:
+                leading = []
+        else:
+            leading = self.leading_files(prompt.get_content())
+            if len(leading) == len(contents):
+                leading = []
+        system_parts = [part for message in system_instructions for part in self.as_list(message.get_content())]
+        if not system_parts and not leading:
+            return self.model, contents, system_instructions
+
+        prefix = [{'role': 'user', 'parts': [self.serialize_one_part(file) for file in leading]}] if leading else []
+        system_instruction = self.serialize_system_instructions(system_instructions) if system_instructions else None
+        handle = self.context_cache.get_handle(self.model_name, system_parts + leading, system_instruction, prefix)
+        if handle is None:
+            return self.model, contents, system_instructions
+
+        if leading and isinstance(prompt, ChatPrompt):
+            rest = dict(contents[0], parts=remaining_parts)
+            contents = ([rest] if remaining_parts else []) + contents[1:]
+        elif leading:
+            contents = contents[len(leading):]
+        return self.get_cached_model(system_parts + leading, handle), contents, []
+
+    def get_cached_model(self, parts: List[Part], handle) -> 'genai.GenerativeModel':
+        """the model bound to the handle, kept per prefix and replaced when the handle is recreated"""
+        key = self.context_cache.prefix_key(self.model_name, parts)
+        name, model = self._cached_models.get(key, (None, None))
+        if name != handle.name:
+            model = self.context_cache.backend.get_model(handle)
+            if self.client is not None:
+                model._client = self.client.generative
+            # drop the models of prefixes the registry no longer holds a handle for
+            for stale in [stale for stale in self._cached_models if stale not in self.context_cache.handles]:
+                del self._cached_models[stale]
+            self._cached_models[key] = (handle.name, model)
+        return model
+
+    def leading_files(self, parts) -> List[File]:
+        leading = []
+        for part in self.as_list(parts):
+            if not isinstance(part, File):
+                break
+            leading.append(part)
+        return leading
+
+    def as_list(self, parts) -> list:
+        return parts if isinstance(parts, list) else [parts]
 
 
 class OpenAiGenerator(ResponseGenerator, PromptStrategy):
-    def __init__(self, model_name, temperature=0.7, **kwargs):
+    def __init__(self, model_name, temperature=0.7, image_preprocessor: Optional['ImagePreprocessor'] = None,
+                 history_compactor: Optional['HistoryCompactor'] = None, semantic_cache: Optional['SemanticCache'] = None,
+                 client=None, **kwargs):
         if not openai:
             raise MissingLMLibs("Missing OpenAI Libs, install openai package")
+        self.image_preprocessor = image_preprocessor
+        self.history_compactor = history_compactor
+        self.semantic_cache = semantic_cache
         self.model_name = model_name
         self.temperature = temperature
         self.response = None
-        self.client = openai.OpenAI(**kwargs)
+        self.client = client if client is not None else openai.OpenAI(**kwargs)
         self.streamed = False
 
     def generate_response(self, prompt: 'BasePrompt', *args, **kwargs) -> OpenAIResponse:
+        cacheable = self.is_cacheable(kwargs)
+        if cacheable:
+            cached = self.lookup_cache(prompt, kwargs.get('stream', False))
+            if cached is not None:
+                return cached
+        original_prompt = prompt
+
         candidate_count = kwargs.pop('choice_count', 1)
         temperature = kwargs.pop('temperature', self.temperature)
         retry = kwargs.pop('retry', False)
-
+        tools = kwargs.pop('tools', None)
+        if tools:
+            kwargs['tools'] = self.serialize_tools(tools)
+        if kwargs.get('stream', False):
+            # the last chunk then carries the token usage
+            kwargs.setdefault('stream_options', {'include_usage': True})
+
+        prompt = self.compact_history(prompt)
+        self.preprocess_files(prompt)
         contents = prompt.build_prompt(self)
 
         if isinstance(prompt, SingleMessagePrompt):
@@ -183,7 +394,10 @@ class OpenAiGenerator(ResponseGenerator, PromptStrategy):
 
         self.streamed = kwargs.get('stream', False)
         self.response = response
-        return OpenAIResponse(response, self.streamed, self, prompt)
+        result = OpenAIResponse(response, self.streamed, self, prompt)
+        if cacheable:
+            self.store_cache(original_prompt, result)
+        return result
 
     def set_temperature(self, temperature):
         self.temperature = temperature
@@ -196,6 +410,9 @@ class OpenAiGenerator(ResponseGenerator, PromptStrategy):
             final = self.serialize_many_parts(contents)
         elif isinstance(prompt, ChatPrompt):
             for message in contents:
+                if isinstance(message, (ToolCallMessage, ToolMessage)):
+                    final.append(self.serialize_tool_message(message))
+                    continue
                 content = self.serialize_many_parts(message.content)
                 final.append({
                     "role": self.get_appropriate_role(message.role),
@@ -212,6 +429,25 @@ class OpenAiGenerator(ResponseGenerator, PromptStrategy):
         else:
             return "user"
 
+    def serialize_tools(self, tools: List['Tool']) -> list:
+        return [{
+            "type": "function",
+            "function": {"name": tool.name, "description": tool.description, "parameters": tool.parameters}
+        } for tool in tools]
+
+    def serialize_tool_message(self, message: Message) -> dict:
+        if isinstance(message, ToolCallMessage):
+            return {
+                "role": "assistant",
+                "content": str(message.content) or None,
+                "tool_calls": [{
+                    "id": call.id,
+                    "type": "function",
+                    "function": {"name": call.name, "arguments": json.dumps(call.arguments)}
+                } for call in message.tool_calls]
+            }
+        return {"role": "tool", "tool_call_id": message.tool_call_id, "content": str(message.content)}
+
     def serialize_one_part(self, part: Part):
         if isinstance(part, Text):
             return part.content
@@ -225,7 +461,8 @@ class OpenAiGenerator(ResponseGenerator, PromptStrategy):
             raise BadInputException(
                 "File is not an image", "Only images are supported for file uploads in openai")
         if file.inline:
-            return {'type': 'image_url', 'image_url': {'url': f"data:image/jpeg;base64,{file.base64_data}"}}
+            mime_type, _, base64_data = self.get_file_payload(file)
+            return {'type': 'image_url', 'image_url': {'url': f"data:{mime_type};base64,{base64_data}"}}
         return {'type': 'image_url', 'image_url': {'url': file.uri}}
 
     def serialize_many_parts(self, parts: Iterable[Part]) -> str:
@@ -0,0 +1,305 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from .types import Any, Callable, Dict, Iterable, List, Optional, TYPE_CHECKING
+from .model_registry import genai, openai
+from .generators import ResponseGenerator
+from .embeddings import EmbeddingGenerator
+from .exceptions import MissingLMLibs, NoKeyAvailable
+if TYPE_CHECKING:
+    from .responses import Response
+    from .prompts.prompts import BasePrompt
+
+STRATEGIES = ('least_outstanding', 'remaining_quota')
+
+
+def openai_client(key: str) -> Any:
+    if not openai:
+        raise MissingLMLibs("Missing OpenAI Libs, install openai package")
+    return openai.OpenAI(api_key=key)
+
+
+class GeminiClients:
+    """the gemini service clients of one key, each built on first use"""
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self._clients: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name: str, client_class) -> Any:
+        with self._lock:
+            if name not in self._clients:
+                self._clients[name] = client_class(client_options={'api_key': self.key})
+            return self._clients[name]
+
+    @property
+    def generative(self) -> Any:
+        from google.ai import generativelanguage as glm
+        return self._get('generative', glm.GenerativeServiceClient)
+
+    @property
+    def files(self) -> Any:
+        from google.generativeai.client import FileServiceClient
+        return self._get('files', FileServiceClient)
+
+    @property
+    def caching(self) -> Any:
+        from google.ai import generativelanguage as glm
+        return self._get('caching', glm.CacheServiceClient)
+
+
+def gemini_client(key: str) -> GeminiClients:
+    """the clients bound to the key, unlike genai.configure it leaves the global config alone"""
+    if genai is None:
+        raise MissingLMLibs("Missing Gemini Libs, install google's generativeai")
+    return GeminiClients(key)
+
+
+def error_status(error: BaseException) -> Optional[int]:
+    """the HTTP status of a provider error, openai errors carry status_code and google api errors code"""
+    for attr in ('status_code', 'code'):
+        status = getattr(error, attr, None)
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class ApiKey:
+    """one credential of a pool, with its dedicated client and usage counters"""
+
+    def __init__(self, key: str, label: str, requests_per_minute: Optional[int] = None) -> None:
+        self.key = key
+        self.label = label
+        self.requests_per_minute = requests_per_minute
+        self.client: Any = None
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.auth_errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.ejected_until = 0.0
+        self._recent: deque = deque()
+
+    def available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def remaining_quota(self, now: float) -> float:
+        """requests left in the current minute, infinite when the key has no known limit"""
+        while self._recent and self._recent[0] <= now - 60:
+            self._recent.popleft()
+        if self.requests_per_minute is None:
+            return float('inf')
+        return self.requests_per_minute - len(self._recent)
+
+    def usage(self) -> Dict[str, Any]:
+        return {
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'failures': self.failures,
+            'rate_limited': self.rate_limited,
+            'auth_errors': self.auth_errors,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'ejected_for': max(0.0, self.ejected_until - time.monotonic()),
+        }
+
+
+class KeyPool:
+    """Spreads the requests to one provider over several API keys.
+
+    Every key gets its own client, built by client_factory on first use. A key is picked either
+    with the fewest requests in flight or with the most requests left in the minute, ties go to the
+    key used least. A 429 takes the key out of rotation for rate_limit_cooldown seconds (or the
+    provider's retry-after), a 401 or 403 for auth_cooldown seconds.
+
+    Args:
+        keys (Iterable[str]): the API keys
+        client_factory (Callable): builds the client of a key, e.g. openai_client or gemini_client
+        strategy (str): 'least_outstanding' or 'remaining_quota'
+        requests_per_minute (int): the rate limit of each key, used by the remaining_quota strategy
+        rate_limit_cooldown (float): seconds a rate limited key is left out
+        auth_cooldown (float): seconds a key with an auth error is left out
+    """
+
+    def __init__(
+        self,
+        keys: Iterable[str],
+        client_factory: Callable[[str], Any],
+        strategy: str = 'least_outstanding',
+        requests_per_minute: Optional[int] = None,
+        rate_limit_cooldown: float = 30,
+        auth_cooldown: float = 600,
+    ) -> None:
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown strategy {strategy}, expected one of {STRATEGIES}")
+        self.keys: List[ApiKey] = [
+            ApiKey(key, f"key-{index}-{key[-4:]}", requests_per_minute) for index, key in enumerate(keys)
+        ]
+        if not self.keys:
+            raise ValueError("A key pool needs at least one key")
+        self.client_factory = client_factory
+        self.strategy = strategy
+        self.rate_limit_cooldown = rate_limit_cooldown
+        self.auth_cooldown = auth_cooldown
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def get_client(self, api_key: ApiKey) -> Any:
+        with self._lock:
+            if api_key.client is None:
+                api_key.client = self.client_factory(api_key.key)
+            return api_key.client
+
+    def pick(self) -> ApiKey:
+        """reserves the best available key, release it with report_success or report_failure"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [api_key for api_key in self.keys if api_key.available(now)]
+            if not candidates:
+                soonest = min(api_key.ejected_until for api_key in self.keys) - now
+                raise NoKeyAvailable(f"all {len(self.keys)} keys are out of rotation, next one is back in {soonest:.1f}s")
+            if self.strategy == 'remaining_quota':
+                api_key = max(candidates, key=lambda k: (k.remaining_quota(now) - k.outstanding, -k.requests))
+            else:
+                api_key = min(candidates, key=lambda k: (k.outstanding, k.requests))
+            api_key.outstanding += 1
+            api_key.requests += 1
+            api_key._recent.append(now)
+            return api_key
+
+    def report_success(self, api_key: ApiKey, usage: Optional[Dict[str, int]] = None):
+        with self._lock:
+            api_key.outstanding -= 1
+            if usage:
+                api_key.prompt_tokens += usage.get('prompt_tokens', 0)
+                api_key.completion_tokens += usage.get('completion_tokens', 0)
+
+    def report_failure(self, api_key: ApiKey, error: BaseException):
+        status = error_status(error)
+        with self._lock:
+            api_key.outstanding -= 1
+            api_key.failures += 1
+            if status == 429:
+                api_key.rate_limited += 1
+                cooldown = retry_after(error) or self.rate_limit_cooldown
+            elif status in (401, 403):
+                api_key.auth_errors += 1
+                cooldown = self.auth_cooldown
+            else:
+                return
+            api_key.ejected_until = max(api_key.ejected_until, time.monotonic() + cooldown)
+
+    @contextmanager
+    def lease(self):
+        """picks a key for the duration of a request, provider errors are reported and re-raised"""
+        api_key = self.pick()
+        try:
+            yield api_key
+        except BaseException as e:
+            self.report_failure(api_key, e)
+            raise
+        else:
+            self.report_success(api_key)
+
+    def usage(self) -> Dict[str, Dict[str, Any]]:
+        """counters per key, keyed by a label that does not reveal the key"""
+        with self._lock:
+            return {api_key.label: api_key.usage() for api_key in self.keys}
+
+
+class PooledGenerator(ResponseGenerator):
+    """Sends every request with a key from a KeyPool.
+
+    One generator is built per key by generator_factory, which receives the key's client. A request
+    failing on a rate limited or rejected key is retried once on another key when one is available.
+    A streamed response holds its key until the stream ends, its usage is recorded then.
+    """
+
+    def __init__(self, pool: KeyPool, generator_factory: Callable[[Any], ResponseGenerator], failover: bool = True) -> None:
+        self.pool = pool
+        self.generator_factory = generator_factory
+        self.failover = failover
+        self.generators: Dict[str, ResponseGenerator] = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.get_generator(self.pool.keys[0]), name)
+
+    @property
+    def model_name(self) -> str:
+        return self.get_generator(self.pool.keys[0]).model_name
+
+    def get_generator(self, api_key: ApiKey) -> ResponseGenerator:
+        with self._lock:
+            generator = self.generators.get(api_key.label)
+        if generator is None:
+            generator = self.generator_factory(self.pool.get_client(api_key))
+            with self._lock:
+                generator = self.generators.setdefault(api_key.label, generator)
+        return generator
+
+    def generate_response(self, prompt: 'BasePrompt', *args, **kwargs) -> 'Response':
+        attempts = 2 if self.failover and len(self.pool) > 1 else 1
+        error = None
+        for attempt in range(attempts):
+            try:
+                api_key = self.pool.pick()
+            except NoKeyAvailable:
+                if error is None:
+                    raise
+                raise error
+            try:
+                response = self.get_generator(api_key).generate_response(prompt, *args, **kwargs)
+            except Exception as e:
+                self.pool.report_failure(api_key, e)
+                error = e
+                if attempt + 1 < attempts and error_status(e) in (401, 403, 429):
+                    continue
+                raise
+            if response.streamed:
+                response.add_done_callback(lambda done, api_key=api_key: self.pool.report_success(api_key, done.get_usage()))
+            else:
+                self.pool.report_success(api_key, response.get_usage())
+            return response
+
+
+class PooledEmbeddingGenerator(EmbeddingGenerator):
+    """Sends every embedding batch with a key from a KeyPool, one embedder is built per key by embedder_factory"""
+
+    def __init__(self, pool: KeyPool, embedder_factory: Callable[[Any], EmbeddingGenerator]) -> None:
+        self.pool = pool
+        self.embedder_factory = embedder_factory
+        self.embedders: Dict[str, EmbeddingGenerator] = {}
+        self._lock = threading.Lock()
+        first = self.get_embedder(pool.keys[0])
+        super().__init__(first.model_name, first.batch_size)
+
+    def get_embedder(self, api_key: ApiKey) -> EmbeddingGenerator:
+        with self._lock:
+            embedder = self.embedders.get(api_key.label)
+        if embedder is None:
+            embedder = self.embedder_factory(self.pool.get_client(api_key))
+            with self._lock:
+                embedder = self.embedders.setdefault(api_key.label, embedder)
+        return embedder
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        with self.pool.lease() as api_key:
+            return self.get_embedder(api_key).embed_batch(texts)
@@ -79,6 +79,7 @@ def update_openai_models():
 
 gemini_provider = Provider('gemini', 
                            default_model='gemini-1.5-pro-latest',
+                           default_embedding_model='text-embedding-004',
                            initial_models={
 
                                'gemini-1.5-pro-latest': {'some': 'data'},
@@ -90,6 +91,7 @@ gemini_provider = Provider('gemini',
 
 openai_provider = Provider('openai', 
                            default_model='gpt-4o-mini', 
+                           default_embedding_model='text-embedding-3-small',
                            initial_models={
                                'gpt-4o-mini': {'some': 'data'},
                                'gpt-3.5-turbo': {'other': 'data'}
@@ -97,13 +99,17 @@ openai_provider = Provider('openai',
 
 def register_openai_default_provider():
     from .generators import OpenAiGenerator
+    from .embeddings import OpenAiEmbeddingGenerator
     
     models.add_provider(openai_provider)
     openai_provider.set_generator(OpenAiGenerator)
+    openai_provider.set_embedder(OpenAiEmbeddingGenerator)
     
 
 def register_gemini_default_provider():
     from .generators import GeminiGenerator
+    from .embeddings import GeminiEmbeddingGenerator
     
     models.add_provider(gemini_provider)
-    gemini_provider.set_generator(GeminiGenerator)
\ No newline at end of file
+    gemini_provider.set_generator(GeminiGenerator)
+    gemini_provider.set_embedder(GeminiEmbeddingGenerator)
\ No newline at end of file
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import hashlib
+import io
+from collections import OrderedDict
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from threading import Lock
+from .types import Dict, Iterable, List, Optional, Tuple
+from .prompts.parts import File
+from .exceptions import MissingLMLibs
+
+
+def import_image_libs():
+    try:
+        from PIL import Image
+    except ImportError:
+        Image = None
+    return Image
+
+
+Image = import_image_libs()
+
+
+_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+    (b'%PDF', 'application/pdf'),
+)
+
+_FORMAT_MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+    'PNG': 'image/png',
+}
+
+_ORIENTATION = 0x0112
+_METADATA_KEYS = ('exif', 'xmp', 'XML:com.adobe.xmp', 'comment')
+
+
+def detect_mime_type(data: bytes, fallback: Optional[str] = None) -> Optional[str]:
+    """Detect the mime type of raw file data from its magic bytes, returns fallback if unknown"""
+    for signature, mime_type in _SIGNATURES:
+        if data.startswith(signature):
+            return mime_type
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[4:12] in (b'ftypheic', b'ftypheix', b'ftypmif1'):
+        return 'image/heic'
+    return fallback
+
+
+def _process_image_bytes(data: bytes, max_dimension: int, image_format: str, quality: int, strip_metadata: bool) -> Tuple[bytes, str]:
+    # runs inside the worker processes, must stay a module level function so it can be pickled
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as source:
+        source_mime_type = _FORMAT_MIME_TYPES.get(source.format)
+        unchanged = source.getexif().get(_ORIENTATION, 1) == 1 and max(source.size) <= max_dimension
+        image = ImageOps.exif_transpose(source)
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = _flatten(image)
+        save_kwargs = {'format': image_format, 'quality': quality, 'optimize': True}
+        if not strip_metadata:
+            exif = image.info.get('exif')
+            if exif:
+                save_kwargs['exif'] = exif
+        output = io.BytesIO()
+        image.save(output, **save_kwargs)
+        if unchanged and source_mime_type is not None and output.tell() >= len(data):
+            # recompressing a small image would only grow it and add artifacts, the original is kept
+            if not strip_metadata or not _has_metadata(source):
+                return data, source_mime_type
+            stripped = io.BytesIO()
+            if source.format == 'JPEG':
+                # saved again without the metadata, 'keep' reuses the quantization tables so it is not degraded
+                source.save(stripped, format='JPEG', quality='keep')
+                return stripped.getvalue(), source_mime_type
+            if source.format == 'PNG':
+                source.save(stripped, format='PNG', optimize=True)
+                return stripped.getvalue(), source_mime_type
+    return output.getvalue(), _FORMAT_MIME_TYPES[image_format]
+
+
+def _has_metadata(image) -> bool:
+    return bool(image.getexif()) or any(key in image.info for key in _METADATA_KEYS) or bool(getattr(image, 'text', None))
+
+
+def _flatten(image):
+    # jpeg has no alpha channel, transparent regions are composited onto white instead of turning black
+    from PIL import Image
+
+    if image.mode == 'P' and 'transparency' in image.info:
+        image = image.convert('RGBA')
+    if image.mode in ('RGBA', 'LA', 'PA'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+class ProcessedImage:
+    def __init__(self, data: bytes, mime_type: str) -> None:
+        self.data = data
+        self.mime_type = mime_type
+
+    @property
+    def base64_data(self) -> str:
+        import base64
+        return base64.b64encode(self.data).decode('utf-8')
+
+
+class ImagePreprocessor:
+    """Downsizes, recompresses and strips metadata off inline image attachments before they are sent.
+
+    An image that needs no resizing and would not get smaller is kept in its original format,
+    only saved again when it carries metadata to strip. The CPU heavy work runs in a process pool and results are cached by the content hash
+    of the original data, so an attachment that is sent repeatedly is only processed once.
+
+    Args:
+        max_dimension (int): the default maximum width/height in pixels
+        model_max_dimensions (Dict[str, int]): per model overrides of max_dimension
+        image_format (str): 'JPEG' or 'WEBP'
+        quality (int): the recompression quality target
+        strip_metadata (bool): whether to drop EXIF and other metadata
+        max_workers (int): size of the process pool
+        executor (Executor): use an existing executor instead of creating a process pool
+        max_cache_bytes (int): least recently used results are evicted once the cached data is bigger
+    """
+
+    supported_types = ('image/jpeg', 'image/png', 'image/webp', 'image/gif', 'image/bmp')
+
+    def __init__(
+        self,
+        max_dimension: int = 2048,
+        model_max_dimensions: Optional[Dict[str, int]] = None,
+        image_format: str = 'JPEG',
+        quality: int = 85,
+        strip_metadata: bool = True,
+        max_workers: Optional[int] = None,
+        executor: Optional[Executor] = None,
+        max_cache_bytes: int = 256 * 1024 * 1024,
+    ) -> None:
+        if Image is None:
+            raise MissingLMLibs("Missing image libs, install Pillow to use image preprocessing")
+        image_format = image_format.upper()
+        if image_format not in ('JPEG', 'WEBP'):
+            raise ValueError(f"Unsupported image format {image_format}, use JPEG or WEBP")
+        self.max_dimension = max_dimension
+        self.model_max_dimensions = model_max_dimensions or {}
+        self.image_format = image_format
+        self.quality = quality
+        self.strip_metadata = strip_metadata
+        self.max_workers = max_workers
+        self._executor = executor
+        self.max_cache_bytes = max_cache_bytes
+        self._cache: OrderedDict = OrderedDict()
+        self._cache_bytes = 0
+        self._pending: Dict[Tuple[str, int], Future] = {}
+        self._lock = Lock()
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def get_max_dimension(self, model_name: Optional[str] = None) -> int:
+        return self.model_max_dimensions.get(model_name, self.max_dimension)
+
+    def is_processable(self, file: File) -> bool:
+        if not file.inline:
+            return False
+        return detect_mime_type(file.data, file.type) in self.supported_types
+
+    def submit(self, file: File, model_name: Optional[str] = None) -> Future:
+        """Schedule a file for processing and return a future of its ProcessedImage"""
+        key = self._cache_key(file, model_name)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                future = Future()
+                future.set_result(self._cache[key])
+                return future
+            if key in self._pending:
+                return self._pending[key]
+            future = self.executor.submit(
+                _process_image_bytes, file.data, key[1], self.image_format, self.quality, self.strip_metadata)
+            self._pending[key] = future
+        future.add_done_callback(lambda f: self._store(key, f))
+        return future
+
+    def process(self, file: File, model_name: Optional[str] = None) -> ProcessedImage:
+        """Process a single file, blocking until the result is available"""
+        result = self.submit(file, model_name).result()
+        return result if isinstance(result, ProcessedImage) else ProcessedImage(*result)
+
+    def process_many(self, files: Iterable[File], model_name: Optional[str] = None) -> List[ProcessedImage]:
+        """Process many files concurrently in the pool, order is preserved"""
+        futures = [self.submit(file, model_name) for file in files]
+        results = [future.result() for future in futures]
+        return [result if isinstance(result, ProcessedImage) else ProcessedImage(*result) for result in results]
+
+    def get_cached(self, file: File, model_name: Optional[str] = None) -> Optional[ProcessedImage]:
+        return self._cache.get(self._cache_key(file, model_name))
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+            self._cache_bytes = 0
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    def _cache_key(self, file: File, model_name: Optional[str]) -> Tuple[str, int]:
+        digest = getattr(file, '_content_hash', None)
+        if digest is None:
+            digest = hashlib.sha256(file.data).hexdigest()
+            file._content_hash = digest
+        return digest, self.get_max_dimension(model_name)
+
+    def _store(self, key: Tuple[str, int], future: Future):
+        with self._lock:
+            self._pending.pop(key, None)
+            if future.cancelled() or future.exception() is not None:
+                return
+            processed = ProcessedImage(*future.result())
+            if key in self._cache:
+                self._cache_bytes -= len(self._cache.pop(key).data)
+            self._cache[key] = processed
+            self._cache_bytes += len(processed.data)
+            while self._cache_bytes > self.max_cache_bytes and self._cache:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= len(evicted.data)
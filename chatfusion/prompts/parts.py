@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from mimetypes import guess_type
 from typing import TYPE_CHECKING
-from ..types import Content, FileTypeCheck, Iterable, Message as DictMessage, File as FileType
+from ..types import Content, FileTypeCheck, Iterable, Message as DictMessage, File as FileType, Callable, Dict
 from uuid import uuid4
 import base64
 
@@ -19,30 +19,8 @@ class Part:
     
 class PartConvertableMixin:
     def to_part(self, content: Content) -> Part:
-        if isinstance(content, str):
-            return Text(content)
-        elif isinstance(content, FileTypeCheck):
-            return File(content)
-        elif isinstance(content, File):
-            return content
-        elif isinstance(content, Text):
-            return content
-        elif isinstance(content, Iterable):
-            temp = []
-            for item in content:
-                if isinstance(item, str):
-                    temp.append(Text(item))
-                elif isinstance(item, Iterable):
-                    temp.append(self.to_part(item))
-                elif isinstance(item, File):
-                    temp.append(item)
-                elif isinstance(item, Text):
-                    temp.append(item)
-                else:
-                    raise ValueError(f"Invalid content type: {type(item)}")
-            return temp
-        else:
-            raise ValueError(f"Invalid content type: {type(content)}")
+        converter = _resolved_converters.get(type(content)) or resolve_part_converter(type(content))
+        return converter(self, content)
 
 class PartStringifyMixin:
     def to_str(self, parts: Part):
@@ -105,6 +83,35 @@ class AssistantMessage(Message):
         return cls(Text(text))
 
 
+class ToolCall(Part):
+    def __init__(self, id: str, name: str, arguments: dict, error: str = None) -> None:
+        super().__init__(arguments)
+        self.id = id
+        self.name = name
+        self.arguments = arguments
+        # set when the model sent arguments that could not be parsed, the call is answered with the error
+        self.error = error
+
+    def __str__(self) -> str:
+        return f"{self.name}({self.arguments})"
+
+
+class ToolCallMessage(Message):
+    def __init__(self, tool_calls: list[ToolCall], content: Content = '') -> None:
+        super().__init__('assistant', content)
+        self.tool_calls = list(tool_calls)
+
+    def __str__(self) -> str:
+        return f"{self.get_role()}: {self.to_str(self.tool_calls)}"
+
+
+class ToolMessage(Message):
+    def __init__(self, tool_call_id: str, name: str, content: str) -> None:
+        super().__init__('tool', content)
+        self.tool_call_id = tool_call_id
+        self.name = name
+
+
 class Text(Part):
     def __init__(self, text: str) -> None:
         if not isinstance(text, str):
@@ -150,3 +157,53 @@ class File(Part):
     def get_file_object(self):
         return self._file
 
+
+def _keep_part(mixin: PartConvertableMixin, content: Part) -> Part:
+    return content
+
+
+def _to_text(mixin: PartConvertableMixin, content: str) -> Text:
+    return Text(content)
+
+
+def _to_file(mixin: PartConvertableMixin, content: FileType) -> File:
+    return File(content)
+
+
+def _to_parts(mixin: PartConvertableMixin, content: Iterable) -> list:
+    to_part = mixin.to_part
+    return [to_part(item) for item in content]
+
+
+def _invalid_content(mixin: PartConvertableMixin, content: any) -> Part:
+    raise ValueError(f"Invalid content type: {type(content)}")
+
+
+# converters of to_part by type of the content, a subclass uses the converter of its closest
+# registered base, anything else that is iterable is converted item by item
+PART_CONVERTERS: Dict[type, Callable[[PartConvertableMixin, any], any]] = {
+    str: _to_text,
+    FileTypeCheck: _to_file,
+    File: _keep_part,
+    Text: _keep_part,
+}
+
+# converters resolved by exact type, so converting content of a type seen before is a single dict lookup
+_resolved_converters: Dict[type, Callable[[PartConvertableMixin, any], any]] = {}
+
+
+def register_part_converter(content_type: type, converter: Callable[[PartConvertableMixin, any], any]):
+    """makes to_part convert content of content_type and its subclasses with converter(mixin, content)"""
+    PART_CONVERTERS[content_type] = converter
+    _resolved_converters.clear()
+
+
+def resolve_part_converter(content_type: type) -> Callable[[PartConvertableMixin, any], any]:
+    converter = next((PART_CONVERTERS[base] for base in content_type.__mro__ if base in PART_CONVERTERS), None)
+    if converter is None:
+        # abstract bases like IOBase are not in the mro of the classes registered to them
+        converter = next((converter for base, converter in PART_CONVERTERS.items() if issubclass(content_type, base)), None)
+    if converter is None:
+        converter = _to_parts if issubclass(content_type, Iterable) else _invalid_content
+    _resolved_converters[content_type] = converter
+    return converter
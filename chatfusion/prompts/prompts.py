@@ -1,10 +1,44 @@
 from __future__ import annotations
 
-from ..types import Iterable, TYPE_CHECKING
+from ..types import Any, Dict, Generator, Iterable, TYPE_CHECKING
 if TYPE_CHECKING:
     from ..types import Message as DictMessage, Content
 from ..types import File as FileType
-from .parts import Part, Text, File, Message, SystemMessage, UserMessage, AssistantMessage
+from .parts import Part, Text, File, Message, SystemMessage, UserMessage, AssistantMessage, ToolCall, ToolCallMessage, ToolMessage
+
+# rows converted to python objects at a time when reading columnar data
+BULK_CHUNK_SIZE = 65536
+
+
+def iter_column(column: Any, chunk_size: int = BULK_CHUNK_SIZE) -> Generator[Any, None, None]:
+    """
+    lazily yields the values of a list, generator, NumPy array, pandas Series or Arrow (Chunked)Array
+    columnar data is converted to python objects chunk_size rows at a time instead of element by element
+    """
+    if hasattr(column, 'chunks'):
+        # an arrow ChunkedArray
+        for chunk in column.chunks:
+            yield from iter_column(chunk, chunk_size)
+        return
+    to_list = next((name for name in ('to_pylist', 'tolist') if hasattr(column, name)), None)
+    if to_list is None:
+        yield from column
+        return
+    rows = getattr(column, 'iloc', column)
+    for start in range(0, len(column), chunk_size):
+        yield from getattr(rows[start:start + chunk_size], to_list)()
+
+
+def iter_records(records: Any, chunk_size: int = BULK_CHUNK_SIZE) -> Generator[Dict[str, Any], None, None]:
+    """lazily yields the rows of an iterable of dicts, an Arrow Table or a pandas DataFrame as dicts"""
+    if hasattr(records, 'to_batches'):
+        for batch in records.to_batches(chunk_size):
+            yield from batch.to_pylist()
+    elif hasattr(records, 'iloc') and hasattr(records, 'to_dict'):
+        for start in range(0, len(records), chunk_size):
+            yield from records.iloc[start:start + chunk_size].to_dict('records')
+    else:
+        yield from records
 
 
 class BasePrompt:
@@ -66,6 +100,12 @@ class SingleMessagePrompt(BasePrompt):
             part = File(file)
         return SingleMessagePrompt(self.parts + [part])
 
+    @classmethod
+    def from_column(cls, column: Any) -> Generator[SingleMessagePrompt, None, None]:
+        """lazily builds a prompt per string of the column, see iter_column for the accepted columns"""
+        for text in iter_column(column):
+            yield cls([Text(text)])
+
 
 class ChatPrompt(BasePrompt):
     
@@ -91,6 +131,46 @@ class ChatPrompt(BasePrompt):
     def system(self, content: Content):
         message = SystemMessage(content)
         return ChatPrompt(self.parts + [message])
+
+    def tool_calls(self, tool_calls: list[ToolCall], content: Content = ''):
+        return ChatPrompt(self.parts + [ToolCallMessage(tool_calls, content)])
+
+    def tool_result(self, tool_call_id: str, name: str, content: str):
+        return ChatPrompt(self.parts + [ToolMessage(tool_call_id, name, content)])
     
     def get_content(self) -> list[Message]:
         return super().get_content()
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any], prefix: list[Message] = None) -> ChatPrompt:
+        """
+        builds a prompt from a record with either a 'messages' list of role/content dicts,
+        or a 'prompt' and an optional 'system', after the messages of prefix
+        """
+        messages = list(prefix) if prefix else []
+        if 'messages' in record:
+            messages += [Message(message['role'], message['content']) for message in record['messages']]
+        elif 'prompt' in record:
+            if record.get('system'):
+                messages.append(SystemMessage(record['system']))
+            messages.append(UserMessage(record['prompt']))
+        else:
+            raise ValueError("Record must contain a 'prompt' or 'messages' field")
+        return cls(messages)
+
+    @classmethod
+    def from_records(cls, records: Any, system: Content | None = None) -> Generator[ChatPrompt, None, None]:
+        """
+        lazily builds a prompt per record, see from_record and iter_records
+        system is a system prompt shared by all the prompts, its message is built once
+        """
+        prefix = [SystemMessage(system)] if system else None
+        for record in iter_records(records):
+            yield cls.from_record(record, prefix)
+
+    @classmethod
+    def from_column(cls, column: Any, system: Content | None = None) -> Generator[ChatPrompt, None, None]:
+        """lazily builds a prompt with a user message per string of the column, after the shared system prompt"""
+        prefix = [SystemMessage(system)] if system else []
+        for text in iter_column(column):
+            yield cls(prefix + [UserMessage(Text(text))])
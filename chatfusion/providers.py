@@ -1,13 +1,19 @@
 from .types import Dict, Any, Optional, Type, TYPE_CHECKING
 if TYPE_CHECKING:
     from .generators import ResponseGenerator
+    from .key_pool import KeyPool
+    from .embeddings import EmbeddingGenerator
     
 class Provider:
-    def __init__(self, name: str, default_model: str = '', initial_models: Dict[str, Any] = None, api_key: str = ''):
+    def __init__(self, name: str, default_model: str = '', initial_models: Dict[str, Any] = None, api_key: str = '',
+                 default_embedding_model: str = ''):
         self.name = name
         self.models: Dict[str, Any] = initial_models or {}
         self.default_model = default_model
+        self.default_embedding_model = default_embedding_model
         self.generator: Optional[Type['ResponseGenerator']] = None
+        self.embedder: Optional[Type['EmbeddingGenerator']] = None
+        self.key_pool: Optional['KeyPool'] = None
 
     def set_model(self, model_name: str, model_data: Any):
         self.models[model_name] = model_data
@@ -26,3 +32,15 @@ class Provider:
 
     def get_generator(self) -> Optional[Type['ResponseGenerator']]:
         return self.generator
+
+    def set_embedder(self, embedder: Type['EmbeddingGenerator']):
+        self.embedder = embedder
+
+    def get_embedder(self) -> Optional[Type['EmbeddingGenerator']]:
+        return self.embedder
+
+    def set_key_pool(self, key_pool: Optional['KeyPool']):
+        self.key_pool = key_pool
+
+    def get_key_pool(self) -> Optional['KeyPool']:
+        return self.key_pool
@@ -1,10 +1,15 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
+import json
 from typing import Union, Generator, List
-from .types import TYPE_CHECKING, Generator, Union
+from .types import TYPE_CHECKING, Generator, Union, Dict, Any, Optional, Callable
 from .model_registry import genai, openai
-from .exceptions import BadInputException, UnexpectedBehavior, ForbiddenException
+from .exceptions import BadInputException, UnexpectedBehavior, ForbiddenException, InvalidStructuredOutput
+from .structured import IncrementalJSONParser, JSONEvent
+from .prompts.parts import ToolCall
+from .stopping import StopCondition, to_stop_condition
+from .transforms import StreamTransform, TransformPipeline
 if TYPE_CHECKING:
     from .generators import ResponseGenerator
     from .prompts import BasePrompt
@@ -16,12 +21,25 @@ class BaseResponse(ABC):
         pass
 
 
+CLIENT_STOP = 'CLIENT_STOP'
+CANCELLED = 'CANCELLED'
+
+
 class Response(BaseResponse):
     def __init__(self, response, streamed: bool, generator: 'ResponseGenerator', prompt: 'BasePrompt'):
         self._response = response
         self.streamed = streamed
         self.choices = self._get_choices()
         self.generator = generator
+        self.stop_conditions: List[StopCondition] = []
+        # set when the client ended the stream: CLIENT_STOP for a stop condition, CANCELLED for cancel()
+        self.stop_reason: Optional[str] = None
+        self.triggered_condition: Optional[StopCondition] = None
+        self.transforms: Optional[TransformPipeline] = None
+        # the finish reason reported at the end of a stream, set by stream_chunks, or stop_reason when the client ended it
+        self.stream_finish_reason: Optional[str] = None
+        self.finished = not streamed
+        self._done_callbacks: List[Callable[['Response'], None]] = []
 
     def _get_choices(self) -> List:
         return getattr(self._response, 'choices', [self._response])
@@ -34,6 +52,10 @@ class Response(BaseResponse):
     def get_original_response(self):
         return self._response
 
+    def get_usage(self) -> Dict[str, int]:
+        """token usage of the request as prompt_tokens, completion_tokens and total_tokens, zeros if the provider did not report it"""
+        return {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+
     def get_choice(self, index=0):
         if index < 0 or index >= len(self.choices):
             raise IndexError("Choice index out of range")
@@ -60,10 +82,168 @@ class Response(BaseResponse):
                     raise UnexpectedBehavior("API returned an unexpected finish reason","UKNOWN")
         if self.streamed:
             raise ForbiddenException(f"calling text() on a streamed response; use stream_text")
-        return self.get_choice_content(choice)
+        content = self.get_choice_content(choice)
+        if self.transforms is not None:
+            return self.transforms.apply(content)
+        return content
+
+    def transform(self, *stages: StreamTransform) -> 'Response':
+        """
+        chains transform stages onto the response, they run incrementally on stream_text
+        and on the whole text for text(), giving the same result either way
+        """
+        self.transforms = (self.transforms or TransformPipeline()).then(*stages)
+        return self
+
+    def stop_when(self, *conditions: Union[StopCondition, Callable[[str], bool], int, str]) -> 'Response':
+        """
+        adds client side stop conditions to a streamed response, the stream is closed as soon as one
+        of them triggers and stop_reason becomes CLIENT_STOP
+
+        Args:
+            conditions: StopCondition objects, or shorthands: an int max character count,
+                a regex string or a callable predicate over the text so far
+        """
+        self.stop_conditions += [to_stop_condition(condition) for condition in conditions]
+        return self
+
+    def cancel(self, reason: str = CANCELLED):
+        """stops a streamed response right away, closing the underlying connection so no more tokens are generated"""
+        if self.finished and self.stop_reason is None:
+            # the stream already ended on its own
+            return
+        if self.stop_reason is None:
+            self.stop_reason = reason
+            self.stream_finish_reason = reason
+        self.close_stream()
+        self.finish()
+
+    def add_done_callback(self, callback: Callable[['Response'], None]):
+        """calls callback(response) once the stream ends, is stopped or cancelled, right away if it already has"""
+        if self.finished:
+            callback(self)
+        else:
+            self._done_callbacks.append(callback)
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        callbacks, self._done_callbacks = self._done_callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    @property
+    def is_stopped(self) -> bool:
+        return self.stop_reason is not None
 
-    @abstractmethod
     def stream_text(self) -> Generator[str, None, None]:
+        if self.transforms is not None:
+            return self.transforms.run(self._stream_text())
+        return self._stream_text()
+
+    def _stream_text(self) -> Generator[str, None, None]:
+        if not self.streamed:
+            raise ForbiddenException("calling stream_text() on a response that was not streamed; use text")
+        text = ''
+        # how much of text was yielded, less than all of it while a condition holds back a possible match
+        emitted = 0
+        holdback = max((condition.holdback for condition in self.stop_conditions), default=0)
+        exhausted = False
+        try:
+            for chunk in self.stream_chunks():
+                if self.is_stopped:
+                    break
+                start = len(text)
+                text += chunk
+                cut = self.check_stop_conditions(text, start) if self.stop_conditions else None
+                if cut is not None:
+                    if cut > emitted:
+                        yield text[emitted:cut]
+                    self.cancel(CLIENT_STOP)
+                    break
+                if not holdback:
+                    emitted = len(text)
+                    yield chunk
+                elif len(text) - holdback > emitted:
+                    safe = len(text) - holdback
+                    yield text[emitted:safe]
+                    emitted = safe
+            else:
+                exhausted = True
+                if emitted < len(text):
+                    yield text[emitted:]
+        except Exception:
+            # closing the stream from another thread makes the provider iterator fail
+            if not self.is_stopped:
+                raise
+        finally:
+            if not exhausted and not self.is_stopped:
+                # the consumer stopped iterating
+                self.cancel()
+            self.finish()
+
+    def check_stop_conditions(self, text: str, start: int) -> Optional[int]:
+        cuts = []
+        for condition in self.stop_conditions:
+            cut = condition.check(text, start)
+            if cut is not None:
+                cuts.append((cut, condition))
+        if not cuts:
+            return None
+        cut, self.triggered_condition = min(cuts, key=lambda item: item[0])
+        return cut
+
+    def stream_json(self, schema: Optional[Dict[str, Any]] = None) -> Generator[JSONEvent, None, None]:
+        """
+        parses a streamed JSON response incrementally, yielding a JSONEvent for every top level field
+        or array element as soon as it closes, and a final 'done' event with the whole document
+
+        if the output becomes invalid (malformed or not matching the schema) the underlying stream is
+        closed so no more tokens are generated and InvalidStructuredOutput is raised
+
+        Args:
+            schema (dict): an optional JSON schema the output must follow
+        """
+        parser = IncrementalJSONParser(schema)
+        try:
+            for chunk in self.stream_text():
+                yield from parser.feed(chunk)
+                if parser.done:
+                    self.cancel(CLIENT_STOP)
+                    break
+            parser.close()
+        except InvalidStructuredOutput:
+            self.cancel(CLIENT_STOP)
+            raise
+
+    def json(self, schema: Optional[Dict[str, Any]] = None, index=0) -> Any:
+        """returns the parsed JSON document of the response, validated against the optional schema"""
+        if self.streamed:
+            event = None
+            for event in self.stream_json(schema):
+                pass
+            return event.value
+        parser = IncrementalJSONParser(schema)
+        parser.feed(self.text(index))
+        return parser.close()
+
+    def has_tool_calls(self, index=0) -> bool:
+        return bool(self.get_tool_calls(index))
+
+    def get_tool_calls(self, index=0) -> List[ToolCall]:
+        """the tool calls the model asked for in a choice, empty if it answered directly"""
+        return []
+
+    def close_stream(self):
+        """closes the underlying stream of a streamed response, does nothing if the provider can not close it"""
+        close = getattr(self._response, 'close', None)
+        if self.streamed and callable(close):
+            close()
+
+    @abstractmethod
+    def stream_chunks(self) -> Generator[str, None, None]:
+        """yields the raw text chunks of the provider stream, stream_text applies stop conditions and cancellation on top"""
         pass
     
     @abstractmethod
@@ -78,18 +258,50 @@ class Response(BaseResponse):
 class OpenAIResponse(Response):
     def __init__(self, response, streamed: bool, generator: 'ResponseGenerator', prompt: 'BasePrompt'):
         super().__init__(response, streamed, generator, prompt)
+        # the usage sent in the last chunk of a stream requested with stream_options include_usage
+        self._stream_usage = None
 
     def _get_choices(self) -> List:
         return self._response.choices if hasattr(self._response, 'choices') else [self._response]
 
-    def stream_text(self) -> Generator[str, None, None]:
+    def stream_chunks(self) -> Generator[str, None, None]:
         for chunk in self._response:
-            if chunk.choices[0].delta.content is not None:
+            if getattr(chunk, 'usage', None) is not None:
+                self._stream_usage = chunk.usage
+            if chunk.choices and chunk.choices[0].finish_reason:
+                self.stream_finish_reason = self.get_finish_reason(chunk.choices[0])
+            if chunk.choices and chunk.choices[0].delta.content is not None:
                 yield chunk.choices[0].delta.content
 
     def get_choice_content(self, choice):
         return choice.message.content
 
+    def get_tool_calls(self, index=0) -> List[ToolCall]:
+        if self.streamed:
+            raise ForbiddenException("tool calls are not available on a streamed response")
+        tool_calls = self.get_choice(index).message.tool_calls or []
+        return [self.parse_tool_call(call) for call in tool_calls]
+
+    def parse_tool_call(self, call) -> ToolCall:
+        raw = call.function.arguments or '{}'
+        try:
+            arguments = json.loads(raw)
+        except json.JSONDecodeError as e:
+            return ToolCall(call.id, call.function.name, {}, f"the arguments are not valid JSON ({e.msg}): {raw[:200]}")
+        if not isinstance(arguments, dict):
+            return ToolCall(call.id, call.function.name, {}, f"the arguments must be a JSON object: {raw[:200]}")
+        return ToolCall(call.id, call.function.name, arguments)
+
+    def get_usage(self) -> Dict[str, int]:
+        usage = self._stream_usage if self.streamed else getattr(self._response, 'usage', None)
+        if usage is None:
+            return super().get_usage()
+        return {
+            'prompt_tokens': usage.prompt_tokens or 0,
+            'completion_tokens': usage.completion_tokens or 0,
+            'total_tokens': usage.total_tokens or 0,
+        }
+
     def get_finish_reason(self, choice):
         reason = choice.finish_reason
         finish_reasons = {
@@ -97,7 +309,7 @@ class OpenAIResponse(Response):
             'length': 'MAX_TOKENS',
             'content_filter': 'SAFETY',
             'function_call': 'FUNCTION_CALL',
-            'tools_call': 'TOOL_CALL',
+            'tool_calls': 'TOOL_CALL',
             'null': 'NULL'
         }
         return finish_reasons.get(reason, 'UNKNOWN')
@@ -114,18 +326,72 @@ class GeminiResponse(Response):
     def _get_choices(self) -> List:
         return self._response.candidates if hasattr(self._response, 'candidates') else [self._response]
 
-    def stream_text(self) -> Generator[str, None, None]:
+    def stream_chunks(self) -> Generator[str, None, None]:
         for chunk in self._response:
-            yield chunk
+            if chunk.candidates and chunk.candidates[0].finish_reason:
+                self.stream_finish_reason = self.get_finish_reason(chunk.candidates[0])
+            yield chunk.text
+
+    def close_stream(self):
+        iterator = getattr(self._response, '_iterator', None)
+        cancel = getattr(iterator, 'cancel', None)
+        if self.streamed and callable(cancel):
+            cancel()
     
     def get_choice_content(self, choice):
         return choice.content.parts[0].text
 
+    def get_tool_calls(self, index=0) -> List[ToolCall]:
+        if self.streamed:
+            raise ForbiddenException("tool calls are not available on a streamed response")
+        calls = []
+        for i, part in enumerate(self.get_choice(index).content.parts):
+            if 'function_call' not in part:
+                continue
+            call = type(part.function_call).to_dict(part.function_call)
+            # gemini does not assign ids to function calls
+            calls.append(ToolCall(f"{call['name']}-{i}", call['name'], call.get('args') or {}))
+        return calls
+
+    def get_usage(self) -> Dict[str, int]:
+        usage = getattr(self._response, 'usage_metadata', None)
+        if usage is None:
+            return super().get_usage()
+        return {
+            'prompt_tokens': usage.prompt_token_count or 0,
+            'completion_tokens': usage.candidates_token_count or 0,
+            'total_tokens': usage.total_token_count or 0,
+        }
+
     def get_finish_reason(self, reason):
+        # accepts a candidate as well, like the other responses
+        reason = getattr(reason, 'finish_reason', reason)
         for attr_name, attr_value in genai.types.protos.Candidate.FinishReason.__dict__.items():
             if attr_value == reason:
                 return attr_name
 
     def is_choice_safe(self, index=0) -> bool:
         choice = self.get_choice(index)
-        return choice.finish_reason == genai.types.protos.Candidate.FinishReason.STOP
\ No newline at end of file
+        return choice.finish_reason == genai.types.protos.Candidate.FinishReason.STOP
+
+
+class CachedResponse(Response):
+    """a response served from a cache instead of the provider"""
+
+    def __init__(self, text: str, streamed: bool, generator: 'ResponseGenerator', prompt: 'BasePrompt'):
+        super().__init__(text, streamed, generator, prompt)
+
+    def _get_choices(self) -> List:
+        return [self._response]
+
+    def stream_chunks(self) -> Generator[str, None, None]:
+        yield self._response
+
+    def get_choice_content(self, choice):
+        return choice
+
+    def get_finish_reason(self, choice):
+        return 'STOP'
+
+    def is_choice_safe(self, index=0) -> bool:
+        return True
@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from .types import Any, Callable, Dict, Optional, Tuple, TYPE_CHECKING
+from .generators import ResponseGenerator
+from .exceptions import DeadlineExceeded
+if TYPE_CHECKING:
+    from .responses import Response
+    from .prompts.prompts import BasePrompt
+
+DEFAULT_PRIORITIES = ('interactive', 'default', 'batch')
+
+
+class _Ticket:
+    def __init__(self, priority: str, tenant: str, deadline: Optional[float]) -> None:
+        self.priority = priority
+        self.tenant = tenant
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.cancelled = False
+        self.on_grant: Callable[[], None] = lambda: None
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+
+class RequestScheduler:
+    """Orders requests to the providers by priority class, then fairly across tenants.
+
+    Classes are served in strict order of priorities. Inside a class, tenants share the slots in
+    proportion to their weights using start time fair queuing, so one tenant's backlog can not
+    starve the others. At most max_concurrency requests are in flight. A request whose deadline
+    passes while queued is dropped before it is sent, and one whose deadline passes in flight is
+    abandoned by the caller (streams are cancelled), its slot is freed when the call returns.
+
+    Args:
+        max_concurrency (int): requests sent to the provider at the same time
+        priorities (Tuple[str]): the priority classes, most important first
+        tenant_weights (Dict[str, float]): share of each tenant, tenants not listed weigh 1
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        priorities: Tuple[str, ...] = DEFAULT_PRIORITIES,
+        tenant_weights: Optional[Dict[str, float]] = None,
+        stats_window: int = 1000,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.priorities = tuple(priorities)
+        self.tenant_weights = tenant_weights or {}
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='chatfusion-scheduler')
+        self.in_flight = 0
+        self._queues: Dict[str, list] = {priority: [] for priority in self.priorities}
+        self._virtual_time: Dict[str, float] = {priority: 0.0 for priority in self.priorities}
+        self._last_finish: Dict[Tuple[str, str], float] = {}
+        self._depth: Dict[Tuple[str, str], int] = {}
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self.dispatched = 0
+        self.shed_queued = 0
+        self.shed_in_flight = 0
+        self._wait_times: Dict[str, deque] = {priority: deque(maxlen=stats_window) for priority in self.priorities}
+
+    def submit(self, ticket: _Ticket):
+        if ticket.priority not in self._queues:
+            raise ValueError(f"Unknown priority {ticket.priority}, expected one of {self.priorities}")
+        with self._lock:
+            key = (ticket.priority, ticket.tenant)
+            start = max(self._virtual_time[ticket.priority], self._last_finish.get(key, 0.0))
+            self._last_finish[key] = start + 1.0 / self.tenant_weights.get(ticket.tenant, 1.0)
+            heapq.heappush(self._queues[ticket.priority], (start, next(self._sequence), ticket))
+            self._depth[key] = self._depth.get(key, 0) + 1
+            self._dispatch()
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._dispatch()
+
+    def withdraw(self, ticket: _Ticket) -> bool:
+        """removes a ticket that is still queued, returns False if it was already granted"""
+        with self._lock:
+            if ticket.granted:
+                return False
+            if not ticket.cancelled:
+                ticket.cancelled = True
+                self._dequeued(ticket)
+                self.shed_queued += 1
+            return True
+
+    def _dispatch(self):
+        while self.in_flight < self.max_concurrency:
+            ticket = self._pop()
+            if ticket is None:
+                return
+            ticket.granted = True
+            self.in_flight += 1
+            self.dispatched += 1
+            self._wait_times[ticket.priority].append(time.monotonic() - ticket.enqueued_at)
+            ticket.on_grant()
+
+    def _pop(self) -> Optional[_Ticket]:
+        for priority in self.priorities:
+            queue = self._queues[priority]
+            while queue:
+                start, _, ticket = heapq.heappop(queue)
+                if ticket.cancelled:
+                    continue
+                self._dequeued(ticket)
+                if ticket.expired():
+                    # the caller already gave up, do not spend quota on it
+                    ticket.cancelled = True
+                    self.shed_queued += 1
+                    continue
+                self._virtual_time[priority] = start
+                return ticket
+        return None
+
+    def _dequeued(self, ticket: _Ticket):
+        key = (ticket.priority, ticket.tenant)
+        self._depth[key] -= 1
+        if not self._depth[key]:
+            del self._depth[key]
+
+    def acquire(self, ticket: _Ticket):
+        """blocks until the ticket is granted a slot, raises DeadlineExceeded if its deadline passes first"""
+        granted = threading.Event()
+        ticket.on_grant = granted.set
+        self.submit(ticket)
+        if not granted.wait(ticket.remaining()) and self.withdraw(ticket):
+            raise DeadlineExceeded()
+
+    async def acquire_async(self, ticket: _Ticket):
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def grant():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        ticket.on_grant = grant
+        self.submit(ticket)
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), ticket.remaining())
+        except asyncio.TimeoutError:
+            if self.withdraw(ticket):
+                raise DeadlineExceeded()
+        except asyncio.CancelledError:
+            if not self.withdraw(ticket):
+                self.release()
+            raise
+
+    def record_shed_in_flight(self):
+        with self._lock:
+            self.shed_in_flight += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            depth: Dict[str, Dict[str, int]] = {priority: {} for priority in self.priorities}
+            for (priority, tenant), count in self._depth.items():
+                depth[priority][tenant] = count
+            waits = {priority: self._wait_stats(times) for priority, times in self._wait_times.items()}
+            return {
+                'in_flight': self.in_flight,
+                'queue_depth': {priority: sum(tenants.values()) for priority, tenants in depth.items()},
+                'queue_depth_by_tenant': depth,
+                'wait_time': waits,
+                'dispatched': self.dispatched,
+                'shed_queued': self.shed_queued,
+                'shed_in_flight': self.shed_in_flight,
+            }
+
+    @staticmethod
+    def _wait_stats(times: deque) -> Dict[str, float]:
+        if not times:
+            return {'count': 0, 'avg': 0.0, 'p95': 0.0, 'max': 0.0}
+        ordered = sorted(times)
+        return {
+            'count': len(ordered),
+            'avg': sum(ordered) / len(ordered),
+            'p95': ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+            'max': ordered[-1],
+        }
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
+
+
+class ScheduledGenerator(ResponseGenerator):
+    """Sends the requests of a generator through a RequestScheduler.
+
+    generate_response and agenerate_response take the scheduling options on top of the usual kwargs:
+        priority (str): one of the scheduler priorities, defaults to 'default'
+        tenant (str): the key requests are shared fairly across
+        timeout (float): seconds from now the caller is willing to wait for the response
+        deadline (float): the same as an absolute time.time() timestamp
+    """
+
+    def __init__(self, generator: ResponseGenerator, scheduler: RequestScheduler) -> None:
+        self.generator = generator
+        self.scheduler = scheduler
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.generator, name)
+
+    @property
+    def model_name(self) -> str:
+        return self.generator.model_name
+
+    def make_ticket(self, priority: str, tenant: str, timeout: Optional[float], deadline: Optional[float]) -> _Ticket:
+        limits = []
+        if timeout is not None:
+            limits.append(time.monotonic() + timeout)
+        if deadline is not None:
+            limits.append(time.monotonic() + deadline - time.time())
+        return _Ticket(priority, tenant, min(limits) if limits else None)
+
+    def generate_response(self, prompt: 'BasePrompt', *args, priority: str = 'default', tenant: str = 'default',
+                          timeout: Optional[float] = None, deadline: Optional[float] = None, **kwargs) -> 'Response':
+        ticket = self.make_ticket(priority, tenant, timeout, deadline)
+        self.scheduler.acquire(ticket)
+        future = self.scheduler.executor.submit(self.generator.generate_response, prompt, *args, **kwargs)
+        future.add_done_callback(lambda _: self.scheduler.release())
+        try:
+            response = future.result(ticket.remaining())
+        except FutureTimeoutError:
+            if future.done():
+                raise
+            self.scheduler.record_shed_in_flight()
+            raise DeadlineExceeded(stage='in flight')
+        return self.limit_stream(response, ticket)
+
+    async def agenerate_response(self, prompt: 'BasePrompt', *args, priority: str = 'default', tenant: str = 'default',
+                                 timeout: Optional[float] = None, deadline: Optional[float] = None, **kwargs) -> 'Response':
+        ticket = self.make_ticket(priority, tenant, timeout, deadline)
+        await self.scheduler.acquire_async(ticket)
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.scheduler.executor, lambda: self.generator.generate_response(prompt, *args, **kwargs))
+        future.add_done_callback(lambda _: self.scheduler.release())
+        try:
+            response = await asyncio.wait_for(asyncio.shield(future), ticket.remaining())
+        except asyncio.TimeoutError:
+            if future.done():
+                raise
+            self.scheduler.record_shed_in_flight()
+            raise DeadlineExceeded(stage='in flight')
+        return self.limit_stream(response, ticket)
+
+    def limit_stream(self, response: 'Response', ticket: _Ticket) -> 'Response':
+        """cancels a streamed response when the deadline passes, unless the stream ended before"""
+        remaining = ticket.remaining()
+        if response.streamed and remaining is not None:
+            timer = threading.Timer(max(0.0, remaining), response.cancel)
+            timer.daemon = True
+            timer.start()
+            response.add_done_callback(lambda _: timer.cancel())
+        return response
@@ -0,0 +1,331 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from threading import RLock
+from .types import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
+from .prompts.prompts import BasePrompt, ChatPrompt
+from .prompts.parts import File, Text, Message
+from .exceptions import MissingLMLibs
+if TYPE_CHECKING:
+    from .embeddings import EmbeddingGenerator
+
+
+def import_vector_libs():
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    return numpy
+
+
+np = import_vector_libs()
+
+
+class BaseVectorIndex(ABC):
+    """Nearest neighbour search over unit vectors by cosine similarity, rows are addressed by position"""
+
+    @abstractmethod
+    def add(self, vectors) -> List[int]:
+        pass
+
+    @abstractmethod
+    def search(self, vector, k: int = 1, mask=None) -> List[Tuple[int, float]]:
+        """returns up to k (row, similarity) pairs, best first, only rows where mask is True are considered"""
+        pass
+
+    @abstractmethod
+    def remove(self, row: int):
+        """removes a row by moving the last row into its place"""
+        pass
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+
+class NumpyVectorIndex(BaseVectorIndex):
+    """Brute force index, a search is one matrix vector product over the stored rows.
+
+    Vectors are normalized on insert so the dot product is the cosine similarity. Storage grows
+    by doubling, removing a row moves the last row into it, and a memory mapped array loaded
+    from disk is only copied into memory on the first write.
+    """
+
+    def __init__(self, dimension: int = 0, dtype: str = 'float32') -> None:
+        if np is None:
+            raise MissingLMLibs("Missing vector libs, install numpy to use the semantic cache")
+        self.dimension = dimension
+        self.dtype = dtype
+        self._vectors = np.zeros((0, dimension), dtype=dtype)
+        self._size = 0
+
+    @property
+    def vectors(self):
+        return self._vectors[:self._size]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def normalize(self, vectors):
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=self.dtype))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def add(self, vectors) -> List[int]:
+        vectors = self.normalize(vectors)
+        if not self.dimension:
+            self.dimension = vectors.shape[1]
+            self._vectors = np.zeros((0, self.dimension), dtype=self.dtype)
+        if vectors.shape[1] != self.dimension:
+            raise ValueError(f"expected vectors of dimension {self.dimension} got {vectors.shape[1]}")
+        needed = self._size + len(vectors)
+        if needed > len(self._vectors) or not self._vectors.flags.writeable:
+            grown = np.zeros((max(needed, 2 * len(self._vectors), 16), self.dimension), dtype=self.dtype)
+            grown[:self._size] = self._vectors[:self._size]
+            self._vectors = grown
+        self._vectors[self._size:needed] = vectors
+        rows = list(range(self._size, needed))
+        self._size = needed
+        return rows
+
+    def search(self, vector, k: int = 1, mask=None) -> List[Tuple[int, float]]:
+        if not self._size:
+            return []
+        similarities = self.vectors @ self.normalize(vector)[0]
+        if mask is not None:
+            similarities = np.where(mask, similarities, -np.inf)
+        k = min(k, self._size)
+        if k == 1:
+            best = [int(np.argmax(similarities))]
+        else:
+            top = np.argpartition(-similarities, k - 1)[:k]
+            best = top[np.argsort(-similarities[top])].tolist()
+        return [(row, float(similarities[row])) for row in best if similarities[row] != -np.inf]
+
+    def remove(self, row: int):
+        if not 0 <= row < self._size:
+            raise IndexError(f"row {row} out of range")
+        if not self._vectors.flags.writeable:
+            self._vectors = self.vectors.copy()
+        last = self._size - 1
+        if row != last:
+            self._vectors[row] = self._vectors[last]
+        self._size = last
+
+    def save(self, path: str):
+        # written aside and swapped in, the vectors may be memory mapped from the file being replaced
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, self.vectors)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'NumpyVectorIndex':
+        vectors = np.load(path, mmap_mode='r' if mmap else None)
+        index = cls(vectors.shape[1], str(vectors.dtype))
+        index._vectors = vectors
+        index._size = len(vectors)
+        return index
+
+
+class CacheEntry:
+    def __init__(self, scope: str, question: str, answer: str, created_at: float, last_access: float) -> None:
+        self.scope = scope
+        self.question = question
+        self.answer = answer
+        self.created_at = created_at
+        self.last_access = last_access
+        # position of the entry's vector in the index
+        self.row = -1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'scope': self.scope, 'question': self.question, 'answer': self.answer,
+                'created_at': self.created_at, 'last_access': self.last_access}
+
+
+def prompt_scope_and_question(prompt: BasePrompt, model_name: str) -> Optional[Tuple[str, str]]:
+    """
+    returns (scope, question) used to key a prompt in the cache, None if the prompt can not be cached
+    the question is the final user message, the scope hashes the model, the system prompt and the
+    earlier turns, so the same follow up in two different conversations does not match
+    """
+    system = []
+    history = []
+    if isinstance(prompt, ChatPrompt):
+        messages = prompt.get_content()
+        if not messages or messages[-1].get_role() != 'user':
+            return None
+        parts = messages[-1].get_content()
+        for message in messages[:-1]:
+            if _has_file(message.get_content()):
+                # files are not part of the text, two conversations could not be told apart
+                return None
+            if message.get_role() == 'system':
+                system.append(_text(message.get_content()))
+            else:
+                history.append(str(message))
+    else:
+        parts = prompt.get_content()
+    if _has_file(parts):
+        return None
+    question = _text(parts)
+    if not question:
+        return None
+    system_text = '\n'.join(system)
+    digest = hashlib.sha256(f"{model_name}\0{system_text}".encode())
+    for turn in history:
+        digest.update(b'\0' + turn.encode())
+    return digest.hexdigest(), question
+
+
+def _has_file(parts) -> bool:
+    return any(isinstance(part, File) for part in (parts if isinstance(parts, list) else [parts]))
+
+
+def _text(parts) -> str:
+    if isinstance(parts, Message):
+        parts = parts.get_content()
+    parts = parts if isinstance(parts, list) else [parts]
+    return ' '.join(part.content for part in parts if isinstance(part, Text))
+
+
+class SemanticCache:
+    """Answers prompts that are paraphrases of earlier ones from a cache instead of calling the model.
+
+    The final user message is embedded and searched in the vector index, restricted to entries
+    with the same model and system prompt. A hit needs a cosine similarity of at least threshold.
+
+    Args:
+        embedder (EmbeddingGenerator): embeds the questions
+        threshold (float): minimum similarity of a hit
+        max_entries (int): least recently used entries are evicted past this size
+        ttl (float): seconds after which entries expire, None keeps them until evicted
+        index (BaseVectorIndex): defaults to a NumpyVectorIndex
+    """
+
+    def __init__(
+        self,
+        embedder: 'EmbeddingGenerator',
+        threshold: float = 0.95,
+        max_entries: int = 10000,
+        ttl: Optional[float] = None,
+        index: Optional[BaseVectorIndex] = None,
+    ) -> None:
+        self.embedder = embedder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.index = index if index is not None else NumpyVectorIndex()
+        # entries[i] is the entry of row i of the index
+        self.entries: List[CacheEntry] = []
+        # entries from least to most recently used
+        self._lru: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = RLock()
+        # questions embedded by a missed lookup, so storing the answer does not embed them again
+        self._recent_vectors: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def lookup(self, prompt: BasePrompt, model_name: str) -> Optional[str]:
+        key = prompt_scope_and_question(prompt, model_name)
+        if key is None:
+            return None
+        scope, question = key
+        vector = self.embed(question)
+        with self._lock:
+            self.evict_expired()
+            mask = np.fromiter((entry.scope == scope for entry in self.entries), dtype=bool, count=len(self.entries))
+            if not mask.any():
+                self.misses += 1
+                return None
+            matches = self.index.search(vector, 1, mask)
+            if not matches or matches[0][1] < self.threshold:
+                self.misses += 1
+                return None
+            entry = self.entries[matches[0][0]]
+            entry.last_access = time.time()
+            self._lru.move_to_end(entry)
+            self.hits += 1
+            return entry.answer
+
+    def store(self, prompt: BasePrompt, model_name: str, answer: str):
+        key = prompt_scope_and_question(prompt, model_name)
+        if key is None:
+            return
+        scope, question = key
+        vector = self.embed(question)
+        now = time.time()
+        with self._lock:
+            entry = CacheEntry(scope, question, answer, now, now)
+            entry.row = self.index.add([vector])[0]
+            self.entries.append(entry)
+            self._lru[entry] = None
+            self.evict_lru()
+
+    def embed(self, question: str):
+        with self._lock:
+            if question in self._recent_vectors:
+                return self._recent_vectors.pop(question)
+        vector = self.embedder.embed_one(question)
+        with self._lock:
+            self._recent_vectors[question] = vector
+            while len(self._recent_vectors) > 256:
+                self._recent_vectors.popitem(last=False)
+        return vector
+
+    def evict_expired(self):
+        if self.ttl is None:
+            return
+        cutoff = time.time() - self.ttl
+        self.remove([entry.row for entry in self.entries if entry.created_at < cutoff])
+
+    def evict_lru(self):
+        with self._lock:
+            while len(self.entries) > self.max_entries:
+                entry = next(iter(self._lru))
+                self.remove([entry.row])
+
+    def remove(self, rows: List[int]):
+        with self._lock:
+            # from the highest row down, so the last row moved into a freed one is never itself removed
+            for row in sorted(set(rows), reverse=True):
+                self.index.remove(row)
+                del self._lru[self.entries[row]]
+                last = self.entries.pop()
+                if row < len(self.entries):
+                    self.entries[row] = last
+                    last.row = row
+
+    def clear(self):
+        self.remove(list(range(len(self.entries))))
+
+    def save(self, directory: str):
+        """writes the vectors as .npy and the entries as JSON to the directory"""
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            self.index.save(os.path.join(directory, 'vectors.npy'))
+            path = os.path.join(directory, 'entries.json')
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump([entry.to_dict() for entry in self.entries], f)
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, directory: str, embedder: 'EmbeddingGenerator', mmap: bool = True, **kwargs) -> 'SemanticCache':
+        """loads a saved cache, with mmap the vectors are memory mapped instead of read into memory"""
+        cache = cls(embedder, index=NumpyVectorIndex.load(os.path.join(directory, 'vectors.npy'), mmap), **kwargs)
+        with open(os.path.join(directory, 'entries.json')) as f:
+            cache.entries = [CacheEntry(**entry) for entry in json.load(f)]
+        for row, entry in enumerate(cache.entries):
+            entry.row = row
+        cache._lru = OrderedDict((entry, None) for entry in sorted(cache.entries, key=lambda entry: entry.last_access))
+        return cache
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import re
+from abc import ABC, abstractmethod
+from .types import Callable, Optional, Union
+
+
+class StopCondition(ABC):
+    """Decides when a streamed generation has produced enough.
+
+    check is called after every chunk with all the text received so far and the offset the new
+    chunk starts at, so conditions only need to look at the new text plus a small lookback.
+    The last holdback characters of the text are not yielded until the next chunk, so a cut
+    before a match that is split across chunks does not come after text already yielded.
+    """
+
+    holdback: int = 0
+
+    @abstractmethod
+    def check(self, text: str, start: int) -> Optional[int]:
+        """returns the length the text should be cut at to stop the stream, or None to keep going"""
+        pass
+
+
+class MaxCharacters(StopCondition):
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+
+    def check(self, text: str, start: int) -> Optional[int]:
+        return self.limit if len(text) >= self.limit else None
+
+
+class RegexMatch(StopCondition):
+    """stops once the pattern matches, keeping the text up to the end of the match (or its start if include is False)
+
+    lookback bounds how far before the new chunk the pattern is searched, it should cover the longest possible match
+    holdback is how many trailing characters are withheld from the consumer, with include False it should
+    cover the longest possible match minus one, otherwise the start of a match may already have been yielded
+    """
+
+    def __init__(self, pattern: Union[str, re.Pattern], include: bool = True, lookback: int = 256, holdback: int = 0) -> None:
+        self.pattern = re.compile(pattern) if isinstance(pattern, str) else pattern
+        self.include = include
+        self.lookback = lookback
+        self.holdback = holdback
+
+    def check(self, text: str, start: int) -> Optional[int]:
+        match = self.pattern.search(text, max(0, start - self.lookback))
+        if match is None:
+            return None
+        return match.end() if self.include else match.start()
+
+
+class StopSequence(RegexMatch):
+    def __init__(self, sequence: str, include: bool = False) -> None:
+        super().__init__(re.escape(sequence), include, lookback=len(sequence),
+                         holdback=0 if include else len(sequence) - 1)
+
+
+class FirstSentence(RegexMatch):
+    """stops after the first sentence, a sentence ends at . ! or ? followed by whitespace"""
+
+    def __init__(self) -> None:
+        super().__init__(r'[.!?](?=\s)', include=True, lookback=1)
+
+
+class Predicate(StopCondition):
+    """stops as soon as the function returns True for the text received so far, keeping all of it"""
+
+    def __init__(self, function: Callable[[str], bool]) -> None:
+        self.function = function
+
+    def check(self, text: str, start: int) -> Optional[int]:
+        return len(text) if self.function(text) else None
+
+
+def to_stop_condition(condition: Union[StopCondition, Callable[[str], bool], int, str, re.Pattern]) -> StopCondition:
+    """accepts shorthands: an int is a character limit, a string or compiled pattern a regex and a callable a predicate"""
+    if isinstance(condition, StopCondition):
+        return condition
+    if isinstance(condition, bool):
+        raise ValueError("a stop condition can not be a bool")
+    if isinstance(condition, int):
+        return MaxCharacters(condition)
+    if isinstance(condition, (str, re.Pattern)):
+        return RegexMatch(condition)
+    if callable(condition):
+        return Predicate(condition)
+    raise ValueError(f"Invalid stop condition type: {type(condition)}")
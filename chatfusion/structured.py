@@ -0,0 +1,275 @@
+from __future__ import annotations
+
+import json
+from copy import copy
+from .types import Any, Dict, Generator, Iterable, List, Optional, Union
+from .exceptions import InvalidStructuredOutput
+
+_WHITESPACE = ' \t\r\n'
+_JSON_TYPES = {
+    'object': dict,
+    'array': list,
+    'string': str,
+    'boolean': bool,
+    'null': type(None),
+}
+
+
+def validate(value: Any, schema: Optional[Dict[str, Any]], path: str = '$'):
+    """validates a value against a subset of JSON schema: type, enum, const, properties, required, additionalProperties and items"""
+    if not schema:
+        return
+    expected = schema.get('type')
+    if expected is not None:
+        types = expected if isinstance(expected, list) else [expected]
+        if not any(_is_type(value, t) for t in types):
+            raise InvalidStructuredOutput(f"expected {expected} got {type(value).__name__}", path)
+    if 'enum' in schema and value not in schema['enum']:
+        raise InvalidStructuredOutput(f"{value!r} is not one of {schema['enum']}", path)
+    if 'const' in schema and value != schema['const']:
+        raise InvalidStructuredOutput(f"{value!r} is not {schema['const']!r}", path)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            validate_property(key, item, schema, path)
+        validate_required(value, schema, path)
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            validate(item, schema.get('items'), f"{path}[{index}]")
+
+
+def validate_property(key: str, value: Any, schema: Dict[str, Any], path: str = '$'):
+    properties = schema.get('properties', {})
+    if key in properties:
+        validate(value, properties[key], f"{path}.{key}")
+    elif schema.get('additionalProperties') is False:
+        raise InvalidStructuredOutput(f"unexpected property {key!r}", path)
+    elif isinstance(schema.get('additionalProperties'), dict):
+        validate(value, schema['additionalProperties'], f"{path}.{key}")
+
+
+def validate_required(value: Dict[str, Any], schema: Dict[str, Any], path: str = '$'):
+    missing = [key for key in schema.get('required', []) if key not in value]
+    if missing:
+        raise InvalidStructuredOutput(f"missing required properties {missing}", path)
+
+
+def _is_type(value: Any, json_type: str) -> bool:
+    if json_type == 'integer':
+        return isinstance(value, int) and not isinstance(value, bool)
+    if json_type == 'number':
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if json_type in ('object', 'array', 'string', 'null'):
+        return isinstance(value, _JSON_TYPES[json_type])
+    if json_type == 'boolean':
+        return isinstance(value, bool)
+    return True
+
+
+class JSONEvent:
+    """an event produced while parsing a streamed JSON document
+
+    Attributes:
+        type (str): 'field' when a top level object field closed, 'item' when a top level array element closed
+            and 'done' when the document is complete
+        key (str | int | None): the field name or the element index
+        value (Any): the completed value, or the whole document for 'done'
+        snapshot (dict | list): a copy of the document with every value completed so far
+    """
+
+    def __init__(self, type: str, key: Union[str, int, None], value: Any, snapshot: Union[Dict, List]) -> None:
+        self.type = type
+        self.key = key
+        self.value = value
+        self.snapshot = snapshot
+
+    def __repr__(self) -> str:
+        return f"JSONEvent(type={self.type!r}, key={self.key!r}, value={self.value!r})"
+
+
+class IncrementalJSONParser:
+    """Parses a JSON object or array fed in arbitrary chunks, emitting each top level field or element as soon as it closes.
+
+    Every completed value is validated against the optional schema right away, so invalid output
+    raises InvalidStructuredOutput without waiting for the rest of the document. A surrounding
+    markdown code fence is tolerated since models often add one.
+    """
+
+    def __init__(self, schema: Optional[Dict[str, Any]] = None) -> None:
+        self.schema = schema
+        self.document: Union[Dict, List, None] = None
+        self.done = False
+        self._closer = ''
+        self._state = 'start'
+        self._buffer: List[str] = []
+        self._key: Optional[str] = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._fence = 0
+        self._events: List[JSONEvent] = []
+
+    def feed(self, chunk: str) -> List[JSONEvent]:
+        self._events = []
+        for char in chunk:
+            if self.done:
+                # anything after the document (a closing fence, chatter) is ignored
+                break
+            self._feed_char(char)
+        return self._events
+
+    def close(self) -> Union[Dict, List]:
+        """signals the end of input, returns the whole document"""
+        if not self.done:
+            raise InvalidStructuredOutput("the output ended before the JSON document was complete")
+        return self.document
+
+    def _feed_char(self, char: str) -> None:
+        state = self._state
+        if state == 'value':
+            return self._feed_value(char)
+        if state == 'key':
+            return self._feed_key(char)
+        if char in _WHITESPACE:
+            return None
+        if state == 'start':
+            return self._start(char)
+        if state == 'expect_key':
+            if char == '"':
+                self._state = 'key'
+                self._buffer = [char]
+                return None
+            if char == '}' and not self.document:
+                return self._finish()
+            raise InvalidStructuredOutput(f"expected a property name got {char!r}", self._path())
+        if state == 'colon':
+            if char != ':':
+                raise InvalidStructuredOutput(f"expected ':' got {char!r}", self._path())
+            self._start_value()
+            return None
+        if state == 'after_value':
+            if char == ',':
+                if isinstance(self.document, dict):
+                    self._state = 'expect_key'
+                else:
+                    self._start_value()
+                return None
+            if char == self._closer:
+                return self._finish()
+            raise InvalidStructuredOutput(f"expected ',' or {self._closer!r} got {char!r}", self._path())
+        if state == 'first_value':
+            if char == ']':
+                return self._finish()
+            self._start_value()
+            return self._feed_value(char)
+        raise InvalidStructuredOutput(f"unexpected {char!r}", self._path())
+
+    def _start(self, char: str) -> None:
+        if char == '`' or (self._fence and char.isalpha()):
+            # skip a leading ``` or ```json fence
+            self._fence += 1
+            return None
+        if char == '{':
+            self.document, self._closer, self._state = {}, '}', 'expect_key'
+        elif char == '[':
+            self.document, self._closer, self._state = [], ']', 'first_value'
+        else:
+            raise InvalidStructuredOutput(f"expected a JSON object or array got {char!r}")
+        if self.schema and 'type' in self.schema:
+            # fail on the opening bracket rather than after streaming a whole document of the wrong type
+            validate(self.document, {'type': self.schema['type']})
+        return None
+
+    def _feed_key(self, char: str) -> None:
+        self._buffer.append(char)
+        if self._escape:
+            self._escape = False
+        elif char == '\\':
+            self._escape = True
+        elif char == '"':
+            self._key = json.loads(''.join(self._buffer))
+            self._state = 'colon'
+        return None
+
+    def _start_value(self):
+        self._state = 'value'
+        self._buffer = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def _feed_value(self, char: str) -> None:
+        if self._in_string:
+            self._buffer.append(char)
+            if self._escape:
+                self._escape = False
+            elif char == '\\':
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                if self._depth == 0:
+                    return self._complete_value()
+            return None
+        if self._depth == 0 and (char == ',' or char == self._closer):
+            if not ''.join(self._buffer).strip():
+                raise InvalidStructuredOutput(f"expected a value got {char!r}", self._path())
+            self._complete_value()
+            return self._feed_char(char)
+        if char in _WHITESPACE and not self._buffer:
+            return None
+        self._buffer.append(char)
+        if char == '"':
+            self._in_string = True
+        elif char in '{[':
+            self._depth += 1
+        elif char in '}]':
+            self._depth -= 1
+            if self._depth < 0:
+                raise InvalidStructuredOutput(f"unbalanced {char!r}", self._path())
+            if self._depth == 0:
+                return self._complete_value()
+        return None
+
+    def _complete_value(self) -> None:
+        raw = ''.join(self._buffer)
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError as e:
+            raise InvalidStructuredOutput(f"could not parse {raw[:50]!r}: {e.msg}", self._path())
+        self._state = 'after_value'
+        self._buffer = []
+        if isinstance(self.document, dict):
+            key = self._key
+            if self.schema:
+                validate_property(key, value, self.schema)
+            self.document[key] = value
+            self._events.append(JSONEvent('field', key, value, copy(self.document)))
+            return None
+        key = len(self.document)
+        if self.schema:
+            validate(value, self.schema.get('items'), f"$[{key}]")
+        self.document.append(value)
+        self._events.append(JSONEvent('item', key, value, copy(self.document)))
+        return None
+
+    def _finish(self) -> None:
+        if self.schema and isinstance(self.document, dict):
+            validate_required(self.document, self.schema)
+        self._state = 'end'
+        self.done = True
+        self._events.append(JSONEvent('done', None, self.document, copy(self.document)))
+        return None
+
+    def _path(self) -> str:
+        if isinstance(self.document, dict):
+            return f"$.{self._key}" if self._state in ('colon', 'value') else '$'
+        if isinstance(self.document, list):
+            return f"$[{len(self.document)}]"
+        return '$'
+
+
+def parse_stream(chunks: Iterable[str], schema: Optional[Dict[str, Any]] = None) -> Generator[JSONEvent, None, Union[Dict, List]]:
+    """yields JSONEvents from a stream of text chunks, returns the complete document"""
+    parser = IncrementalJSONParser(schema)
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    return parser.close()
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import asyncio
+import inspect
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from .types import Any, Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
+from .prompts.prompts import ChatPrompt
+from .prompts.parts import ToolCall
+if TYPE_CHECKING:
+    from .generators import ResponseGenerator
+    from .responses import Response
+
+_PYTHON_TYPES = {str: 'string', int: 'integer', float: 'number', bool: 'boolean', list: 'array', dict: 'object'}
+
+
+class Tool:
+    """A function the model may call.
+
+    Args:
+        function (Callable): a regular or async function called with the arguments the model produced as keywords
+        name (str): defaults to the function name
+        description (str): defaults to the function docstring
+        parameters (dict): JSON schema of the arguments, inferred from the annotations if omitted
+        timeout (float): seconds the tool may run before its call is reported to the model as timed out
+    """
+
+    def __init__(
+        self,
+        function: Callable,
+        name: Optional[str] = None,
+        description: Optional[str] = None,
+        parameters: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+    ) -> None:
+        self.function = function
+        self.name = name or function.__name__
+        self.description = description or inspect.getdoc(function) or ''
+        self.parameters = parameters or self.infer_parameters(function)
+        self.timeout = timeout
+
+    @staticmethod
+    def infer_parameters(function: Callable) -> Dict[str, Any]:
+        properties = {}
+        required = []
+        for name, parameter in inspect.signature(function).parameters.items():
+            if parameter.kind in (parameter.VAR_POSITIONAL, parameter.VAR_KEYWORD):
+                continue
+            annotation = parameter.annotation
+            properties[name] = {'type': _PYTHON_TYPES.get(annotation, 'string')}
+            if parameter.default is parameter.empty:
+                required.append(name)
+        return {'type': 'object', 'properties': properties, 'required': required}
+
+    def __call__(self, **arguments) -> Any:
+        result = self.function(**arguments)
+        if inspect.isawaitable(result):
+            # each worker thread runs its own event loop for async tools
+            result = asyncio.run(_await(result))
+        return result
+
+
+async def _await(awaitable):
+    return await awaitable
+
+
+def tool(function: Optional[Callable] = None, **kwargs):
+    """decorator turning a function into a Tool, usable as @tool or @tool(timeout=5)"""
+    if function is None:
+        return lambda f: Tool(f, **kwargs)
+    return Tool(function, **kwargs)
+
+
+class ToolLoop:
+    """Runs the model, executes the tool calls it asks for and feeds the results back until it answers.
+
+    The tool calls of one turn run concurrently in a thread pool, so a step costs as much as its
+    slowest call. A call that raises or runs past its timeout is reported to the model as an error
+    instead of aborting the loop.
+
+    Args:
+        generator (ResponseGenerator): the generator to call the model with
+        tools (List[Tool]): the tools available to the model
+        max_steps (int): how many model calls the loop may make
+        max_workers (int): size of the thread pool running the tools
+        timeout (float): the default timeout of tools that do not set their own
+    """
+
+    def __init__(
+        self,
+        generator: 'ResponseGenerator',
+        tools: List[Tool],
+        max_steps: int = 10,
+        max_workers: Optional[int] = None,
+        timeout: Optional[float] = 30.0,
+    ) -> None:
+        self.generator = generator
+        self.tools = {t.name: t for t in tools}
+        self.max_steps = max_steps
+        self.max_workers = max_workers
+        self.timeout = timeout
+
+    def run(self, prompt: ChatPrompt, **kwargs) -> Tuple['Response', ChatPrompt]:
+        """
+        Returns:
+            Tuple[Response, ChatPrompt]: the final response and the prompt with every tool call and result appended
+        """
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='chatfusion-tool')
+        try:
+            for _ in range(self.max_steps):
+                response = self.generator.generate_response(prompt, tools=list(self.tools.values()), **kwargs)
+                tool_calls = response.get_tool_calls()
+                if not tool_calls:
+                    return response, prompt
+                prompt = prompt.tool_calls(tool_calls)
+                for call, result in zip(tool_calls, self.execute(tool_calls, executor)):
+                    prompt = prompt.tool_result(call.id, call.name, result)
+        finally:
+            # timed out tools can not be interrupted, do not wait for them
+            executor.shutdown(wait=False)
+        raise RuntimeError(f"the model was still calling tools after {self.max_steps} steps")
+
+    def execute(self, tool_calls: List[ToolCall], executor: ThreadPoolExecutor) -> List[str]:
+        """runs the calls concurrently and returns their serialized results in call order"""
+        started = time.monotonic()
+        futures = []
+        for call in tool_calls:
+            tool = self.tools.get(call.name)
+            futures.append(executor.submit(tool, **call.arguments) if tool and call.error is None else None)
+        results = []
+        for call, future in zip(tool_calls, futures):
+            if call.error is not None:
+                results.append(f"Error: {call.error}")
+                continue
+            if future is None:
+                results.append(f"Error: unknown tool {call.name}")
+                continue
+            timeout = self.tools[call.name].timeout or self.timeout
+            remaining = None if timeout is None else max(0.0, started + timeout - time.monotonic())
+            try:
+                results.append(self.serialize_result(future.result(timeout=remaining)))
+            except FutureTimeoutError:
+                future.cancel()
+                results.append(f"Error: {call.name} timed out after {timeout} seconds")
+            except Exception as e:
+                results.append(f"Error: {type(e).__name__}: {e}")
+        return results
+
+    def serialize_result(self, result: Any) -> str:
+        if isinstance(result, str):
+            return result
+        try:
+            return json.dumps(result)
+        except TypeError:
+            return str(result)
+
+
+def run_tool_loop(generator: 'ResponseGenerator', prompt: ChatPrompt, tools: List[Tool], **kwargs) -> Tuple['Response', ChatPrompt]:
+    return ToolLoop(generator, tools).run(prompt, **kwargs)
@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import re
+from abc import ABC, abstractmethod
+from .types import Callable, Generator, Iterable, List, Union
+
+
+class StreamTransform(ABC):
+    """A stateful stage rewriting text incrementally.
+
+    feed receives each chunk and returns the text that is final so far, holding back a bounded
+    lookahead that could still be changed by the next chunk. flush returns whatever is held back
+    once the stream ends, and reset clears the state so the stage can process another stream.
+    """
+
+    @abstractmethod
+    def feed(self, chunk: str) -> str:
+        pass
+
+    def flush(self) -> str:
+        return ''
+
+    def reset(self):
+        pass
+
+
+class RegexReplace(StreamTransform):
+    """replaces every match of a pattern, including matches split across chunks
+
+    lookahead is how many characters are held back, it must be at least the longest possible match.
+    lookbehind is how many emitted characters are kept for anchors and lookbehinds to look at across chunks,
+    it must be at least the longest lookbehind of the pattern
+    """
+
+    def __init__(self, pattern: Union[str, re.Pattern], replacement: Union[str, Callable] = '', lookahead: int = 64,
+                 lookbehind: int = 64) -> None:
+        self.pattern = re.compile(pattern) if isinstance(pattern, str) else pattern
+        self.replacement = replacement
+        self.lookahead = lookahead
+        self.lookbehind = max(1, lookbehind)
+        self.reset()
+
+    def reset(self):
+        self._buffer = ''
+        # the last lookbehind emitted characters, so ^ and lookbehinds see across the emitted boundary
+        self._context = ''
+
+    def feed(self, chunk: str) -> str:
+        self._buffer += chunk
+        safe = len(self._buffer) - self.lookahead
+        if safe <= 0:
+            return ''
+        return self._emit(safe)
+
+    def flush(self) -> str:
+        return self._emit(len(self._buffer), final=True)
+
+    def _emit(self, safe: int, final: bool = False) -> str:
+        text = self._context + self._buffer
+        offset = len(self._context)
+        safe += offset
+        out = []
+        position = offset
+        for match in self.pattern.finditer(text, offset):
+            if match.start() >= safe:
+                break
+            if not final and match.end() > safe:
+                # the match may still grow with the next chunk, wait for it
+                safe = match.start()
+                break
+            out.append(text[position:match.start()])
+            out.append(match.expand(self.replacement) if isinstance(self.replacement, str) else self.replacement(match))
+            position = match.end()
+        safe = max(safe, position)
+        out.append(text[position:safe])
+        self._buffer = text[safe:]
+        if safe > offset:
+            self._context = text[max(0, safe - self.lookbehind):safe]
+        return ''.join(out)
+
+
+class Redact(RegexReplace):
+    def __init__(self, pattern: Union[str, re.Pattern], replacement: str = '[REDACTED]', lookahead: int = 64,
+                 lookbehind: int = 64) -> None:
+        super().__init__(pattern, replacement, lookahead, lookbehind)
+
+
+class LineFilter(StreamTransform):
+    """drops lines for which keep returns False, a line longer than max_line is passed through as is"""
+
+    def __init__(self, keep: Callable[[str], bool], max_line: int = 4096) -> None:
+        self.keep = keep
+        self.max_line = max_line
+        self.reset()
+
+    def reset(self):
+        self._line = ''
+        self._passthrough = False
+
+    def feed(self, chunk: str) -> str:
+        out = []
+        lines = (self._line + chunk).split('\n')
+        self._line = lines.pop()
+        for line in lines:
+            if self._passthrough or self.keep(line):
+                out.append(line + '\n')
+            self._passthrough = False
+        if self._passthrough or len(self._line) > self.max_line:
+            self._passthrough = True
+            out.append(self._line)
+            self._line = ''
+        return ''.join(out)
+
+    def flush(self) -> str:
+        line, self._line = self._line, ''
+        return line if self._passthrough or (line and self.keep(line)) else ''
+
+
+class MapChunks(StreamTransform):
+    """applies a stateless function to every chunk"""
+
+    def __init__(self, function: Callable[[str], str]) -> None:
+        self.function = function
+
+    def feed(self, chunk: str) -> str:
+        return self.function(chunk)
+
+
+class TransformPipeline(StreamTransform):
+    """chains stages, the output of each stage is fed to the next"""
+
+    def __init__(self, *stages: StreamTransform) -> None:
+        self.stages: List[StreamTransform] = list(stages)
+
+    def then(self, *stages: StreamTransform) -> 'TransformPipeline':
+        return TransformPipeline(*self.stages, *stages)
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+    def feed(self, chunk: str) -> str:
+        for stage in self.stages:
+            if not chunk:
+                return ''
+            chunk = stage.feed(chunk)
+        return chunk
+
+    def flush(self) -> str:
+        text = ''
+        for stage in self.stages:
+            text = stage.feed(text) if text else ''
+            text += stage.flush()
+        return text
+
+    def run(self, chunks: Iterable[str]) -> Generator[str, None, None]:
+        """transforms a stream of chunks, skipping chunks that are held back entirely"""
+        self.reset()
+        try:
+            for chunk in chunks:
+                out = self.feed(chunk)
+                if out:
+                    yield out
+            out = self.flush()
+            if out:
+                yield out
+        finally:
+            close = getattr(chunks, 'close', None)
+            if callable(close):
+                close()
+
+    def apply(self, text: str) -> str:
+        """transforms a whole text, the result is the same as streaming it"""
+        return ''.join(self.run([text]))
+
+
+def strip_markdown(lookahead: int = 8) -> TransformPipeline:
+    """removes headings, emphasis markers and inline code backticks from markdown"""
+    return TransformPipeline(
+        RegexReplace(re.compile(r'^#{1,6}[ \t]+', re.MULTILINE), '', lookahead),
+        RegexReplace(r'\*\*|__', '', lookahead),
+        RegexReplace(r'`', '', lookahead),
+    )
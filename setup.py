@@ -6,6 +6,15 @@ setup(
     packages=find_packages(),
     install_requires=[
     ],
+    entry_points={
+        'console_scripts': [
+            'chatfusion=chatfusion.cli:main',
+        ],
+    },
+    extras_require={
+        'images': ['Pillow'],
+        'semantic': ['numpy'],
+    },
     author='Qusai Albonni',
     author_email='albonniqusai@gmail.com',
     description='A flexible and powerful Python library for interacting with various AI language models',